@@ -8,5 +8,42 @@ app = create_app(Config)
 Migrate(app,db)
 manager = Manager(app)
 manager.add_command('db', MigrateCommand)
+
+
+@manager.command
+def sync_push_tags():
+    """把所有公会成员绑定到对应公会的推送标签"""
+    from server_app.push_notification_tools import group_tag, tag_accounts, TAG_BIND_ACCOUNTS
+    from data.model import Group, User
+    for group in Group.query.all():
+        accounts = [user.username for user in group.users.with_entities(User.username)]
+        if accounts:
+            print(group.id, tag_accounts(group_tag(group.id), accounts, TAG_BIND_ACCOUNTS))
+
+
+@manager.command
+def check_query_plans():
+    """用 EXPLAIN 检查出刀相关的常用查询是否使用了对应的索引"""
+    from server_app.record.query_plan_tools import check_query_plans as check
+    failed = False
+    for name, uses_index, plan in check():
+        print(('OK   ' if uses_index else 'FAIL ') + name)
+        for row in plan:
+            print('    ' + row)
+        failed = failed or not uses_index
+    if failed:
+        raise SystemExit(1)
+
+
+@manager.option('-g', '--group', dest='group_id', default=None, help='只重建这个公会')
+def rebuild_daily_summary(group_id=None):
+    """根据出刀记录重建成员每日合计，用于建表后填充和修复"""
+    from server_app.record.summary_tools import rebuild_daily_summary as rebuild
+    from data.model import db
+    count = rebuild(int(group_id) if group_id else None)
+    db.session.commit()
+    print('%d rows' % count)
+
+
 if __name__ == '__main__':
     manager.run()
@@ -1,26 +1,115 @@
 from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy import inspect
+from collections import namedtuple
 import json
 import datetime
 import time
 
 
+def _timestamp(data):
+    if isinstance(data, datetime.date):
+        return int(time.mktime(data.timetuple()))
+    return data
+
+
+def _encodable(data):
+    data = _timestamp(data)
+    try:
+        json.dumps(data)  # this will fail on non-encodable values, like other classes
+        return data
+    except TypeError:
+        return None
+
+
+FieldPlan = namedtuple('FieldPlan', ['template', 'columns', 'dates', 'others'])
+
+# 每个 model 的字段列表，只在第一次序列化这个 model 时生成
+_field_plans = dict()
+
+
+def _field_plan(obj) -> FieldPlan:
+    """
+    template 为按 dir(obj) 顺序排列、值都为 None 的 dict，columns / dates 为普通列和日期列。
+    不是列的字段（relationship 等）序列化结果总是 None，不需要读取，也不会触发 lazy load。
+    """
+    plan = _field_plans.get(obj.__class__)
+    if plan is None:
+        mapper = inspect(obj.__class__)
+        column_attrs = {attr.key: attr for attr in mapper.column_attrs}
+        relationships = set(mapper.relationships.keys())
+        fields = [x for x in dir(obj) if not x.startswith('_') and x not in ['metadata', 'query', 'query_class']]
+        columns, dates, others = list(), list(), list()
+        for field in fields:
+            if field in column_attrs:
+                try:
+                    python_type = column_attrs[field].columns[0].type.python_type
+                except NotImplementedError:
+                    python_type = datetime.date
+                (dates if issubclass(python_type, datetime.date) else columns).append(field)
+            elif field not in relationships:
+                # 其他属性（方法等）按原来的方式逐个判断
+                others.append(field)
+        plan = FieldPlan(dict.fromkeys(fields), tuple(columns), tuple(dates), tuple(others))
+        _field_plans[obj.__class__] = plan
+    return plan
+
+
+def serialize(obj) -> dict:
+    plan = _field_plan(obj)
+    fields = dict(plan.template)
+    # 已加载的列直接从 __dict__ 读取，跳过 InstrumentedAttribute
+    values = obj.__dict__
+    for field in plan.columns:
+        fields[field] = values[field] if field in values else getattr(obj, field)
+    for field in plan.dates:
+        fields[field] = _timestamp(values[field] if field in values else getattr(obj, field))
+    for field in plan.others:
+        fields[field] = _encodable(getattr(obj, field))
+    return fields
+
+
 class AlchemyEncoder(json.JSONEncoder):
 
     def default(self, obj):
         if isinstance(obj.__class__, DeclarativeMeta):
             # an SQLAlchemy class
-            fields = {}
-            for field in [x for x in dir(obj) if not x.startswith('_')
-                                                 and x not in ['metadata', 'query', 'query_class']]:
-                data = obj.__getattribute__(field)
-                if isinstance(data, datetime.date):
-                    data = int(time.mktime(data.timetuple()))
-                try:
-                    json.dumps(data)  # this will fail on non-encodable values, like other classes
-                    fields[field] = data
-                except TypeError:
-                    fields[field] = None
-            # a json-encodable dict
-            return fields
+            return serialize(obj)
 
         return json.JSONEncoder.default(self, obj)
+
+
+if __name__ == '__main__':
+    # 与原来基于 dir() 反射的实现比较：输出必须完全相同
+    from data.model import PersonalRecord
+    import timeit
+
+    class ReflectionAlchemyEncoder(json.JSONEncoder):
+
+        def default(self, obj):
+            if isinstance(obj.__class__, DeclarativeMeta):
+                fields = {}
+                for field in [x for x in dir(obj) if not x.startswith('_')
+                                                     and x not in ['metadata', 'query', 'query_class']]:
+                    data = obj.__getattribute__(field)
+                    if isinstance(data, datetime.date):
+                        data = int(time.mktime(data.timetuple()))
+                    try:
+                        json.dumps(data)
+                        fields[field] = data
+                    except TypeError:
+                        fields[field] = None
+                return fields
+
+            return json.JSONEncoder.default(self, obj)
+
+    now = datetime.datetime.now()
+    records = [PersonalRecord(id=i, group_id=1, boss_gen=i // 5 + 1, boss_order=i % 5 + 1, damage=i * 1000,
+                              real_damage=None if i % 3 else i * 1000, score=i * 1200, user_id=i % 30,
+                              nickname='キョウカ' + str(i % 30), detail_date=now - datetime.timedelta(minutes=i),
+                              type='normal', epoch_id=1, last_modified=now) for i in range(2000)]
+    data = {"time": int(now.timestamp()), "data": records, "deleted": []}
+
+    assert json.dumps(data, cls=AlchemyEncoder) == json.dumps(data, cls=ReflectionAlchemyEncoder)
+    for encoder in (ReflectionAlchemyEncoder, AlchemyEncoder):
+        seconds = min(timeit.repeat(lambda: json.dumps(data, cls=encoder), number=5, repeat=3)) / 5
+        print('%-26s %.1f ms / 2000 records' % (encoder.__name__, seconds * 1000))
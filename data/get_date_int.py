@@ -1,14 +1,29 @@
-from datetime import timedelta, datetime
-import time
+from datetime import timedelta, timezone, datetime
+from config import Config
+
+# 会战日在每天五点切换，五点前的出刀算入上一天
+BATTLE_DAY_START_HOUR = 5
+# 会战日按哪个时区的五点切换（相对 UTC 的小时数，例如国服为 8）；为 None 时使用服务器本地时区
+BATTLE_DAY_UTC_OFFSET = getattr(Config, 'BATTLE_DAY_UTC_OFFSET', None)
 
 
 def get_date_int(date: datetime, with_hour: bool = False) -> int:
-    format_str = "%Y%m%d"
     if with_hour:
-        format_str = "%Y%m%d%H"
-    today = int(date.strftime(format_str))
-    current_time = int(time.strftime("%H", time.localtime()))
-    # 如果是五点前，出刀算入上一天
-    if current_time < 5 and not with_hour:
-        today = int((date - timedelta(days=1)).strftime("%Y%m%d"))
-    return today
+        return int(date.strftime("%Y%m%d%H"))
+    # 按出刀时间本身判断是否在五点前，而不是按现在的时间
+    return get_battle_day(date)
+
+
+def get_battle_day(date: datetime) -> int:
+    """
+    出刀时间所在的会战日，YYYYMMDD。
+    数据库中的时间是服务器本地时间（不带时区），先换算到会战所在的时区再按五点切换。
+    """
+    if BATTLE_DAY_UTC_OFFSET is not None:
+        date = date.astimezone(timezone(timedelta(hours=BATTLE_DAY_UTC_OFFSET)))
+    return int((date - timedelta(hours=BATTLE_DAY_START_HOUR)).strftime("%Y%m%d"))
+
+
+def battle_day_default(context) -> int:
+    # PersonalRecord.battle_day 的默认值，bulk_save_objects 批量插入时同样有效
+    return get_battle_day(context.get_current_parameters()['detail_date'])
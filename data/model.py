@@ -2,6 +2,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask import Flask, current_app
 import os
 from config import Config
+from data.get_date_int import battle_day_default
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 app = current_app
@@ -62,6 +63,8 @@ class Group(db.Model):
     leader_id = db.Column(db.String(25), nullable=False)
     # 区分是否是机器人添加的临时公会
     is_temp = db.Column(db.Boolean,nullable=False)
+    # 数据版本，公会的出刀记录或成员变化时加一，用作读取接口的 ETag
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     # 查询挂树信息
     hang_on_trees = db.relationship('HangOnTree', backref='group', lazy='dynamic', cascade="all,delete")
     # 查询小组个人出刀记录
@@ -79,6 +82,10 @@ class Group(db.Model):
 
 class TeamRecord(db.Model):
     __tablename__ = 'team_record'
+    __table_args__ = (
+        # 读取公会最新的状态：group_id = ? ORDER BY last_modified DESC
+        db.Index('ix_team_record_group_id_last_modified', 'group_id', 'last_modified'),
+    )
     id = db.Column(db.Integer, primary_key=True, index=True, unique=True, autoincrement=True)
     # 公会代数ID
     epoch_id = db.Column(db.Integer, db.ForeignKey('team_battle_epoch.id'))
@@ -99,6 +106,10 @@ class TeamRecord(db.Model):
 
 class TeamRank(db.Model):
     __tablename__ = 'team_rank'
+    __table_args__ = (
+        # get_records：group_id = ? ORDER BY record_date DESC, id DESC
+        db.Index('ix_team_rank_group_id_record_date', 'group_id', 'record_date'),
+    )
     id = db.Column(db.Integer, primary_key=True, index=True, unique=True, autoincrement=True)
     # 公会代数ID
     epoch_id = db.Column(db.Integer, db.ForeignKey('team_battle_epoch.id'))
@@ -117,6 +128,11 @@ class TeamRank(db.Model):
 
 class DeletionHistory(db.Model):
     __tablename__ = 'deletion_history'
+    __table_args__ = (
+        # 增量同步时查询某个公会某张表在某时间之后删除的记录；MySQL 的 TEXT 列只能按前缀建索引
+        db.Index('ix_deletion_history_group_id_from_table_deleted_date', 'group_id', 'from_table', 'deleted_date',
+                 mysql_length={'from_table': 32}),
+    )
     id = db.Column(db.Integer, primary_key=True, index=True, unique=True, autoincrement=True)
     deleted_date = db.Column(db.DateTime, nullable=False)
     from_table = db.Column(db.Text, nullable=False)
@@ -136,6 +152,14 @@ class TeamBattleEpoch(db.Model):
 
 class PersonalRecord(db.Model):
     __tablename__ = 'personal_record'
+    __table_args__ = (
+        # 按公会查询一段时间内的出刀（OCR 去重等）
+        db.Index('ix_personal_record_group_id_detail_date', 'group_id', 'detail_date'),
+        # 增量同步：group_id = ? AND last_modified >= ?
+        db.Index('ix_personal_record_group_id_last_modified', 'group_id', 'last_modified'),
+        # 按会战日查询和统计：group_id = ? AND battle_day = ? ORDER BY detail_date
+        db.Index('ix_personal_record_group_id_battle_day', 'group_id', 'battle_day', 'detail_date'),
+    )
     id = db.Column(db.Integer, primary_key=True, index=True, unique=True, autoincrement=True)
     # 对应的 Group ID
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'))
@@ -155,6 +179,8 @@ class PersonalRecord(db.Model):
     nickname = db.Column(db.Text, nullable=False)
     # 出刀时间
     detail_date = db.Column(db.DateTime, nullable=False)
+    # 出刀时间所在的会战日，YYYYMMDD，插入时根据 detail_date 自动生成
+    battle_day = db.Column(db.Integer, nullable=False, default=battle_day_default)
     # 出刀类型，normal：普通刀，last：尾刀，compensation：尾刀
     type = db.Column(db.Text, nullable=False)
     # 公会代数ID
@@ -209,4 +235,68 @@ class PictureList(db.Model):
     origin = db.Column(db.Text, nullable=True)
 
     def __repr__(self):
-        return '<picture_list %r' % self.id
\ No newline at end of file
+        return '<picture_list %r' % self.id
+
+
+class Outbox(db.Model):
+    '''后台待发送的推送和QQ消息，发送成功后删除'''
+    __tablename__ = 'outbox'
+    id = db.Column(db.Integer, primary_key=True, index=True, unique=True, autoincrement=True)
+    # 目的地，例如 tpns/qq
+    destination = db.Column(db.VARCHAR(32), nullable=False)
+    # 发送参数，JSON
+    payload = db.Column(db.Text, nullable=False)
+    # 负责发送的进程（主机名:pid）
+    owner = db.Column(db.VARCHAR(255), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    # 在此时间之前由 owner 负责发送，之后可以被其他进程领取
+    claimed_until = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return '<outbox %r' % self.id
+
+
+class ChangeLog(db.Model):
+    '''公会出刀记录、Boss 状态和排名的修改日志，只追加，用于客户端增量同步'''
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        db.Index('ix_change_log_group_id_seq', 'group_id', 'seq'),
+    )
+    id = db.Column(db.Integer, primary_key=True, index=True, unique=True, autoincrement=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    # 序号：这次修改提交时公会的 data_version，同一个事务中的修改序号相同
+    seq = db.Column(db.Integer, nullable=False)
+    # personal_record / team_record / team_rank
+    table_name = db.Column(db.VARCHAR(32), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    # insert / update / delete
+    operation = db.Column(db.VARCHAR(8), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return '<change_log %r' % self.id
+
+
+class MemberDailySummary(db.Model):
+    '''每个成员每个会战日的出刀合计，随出刀记录的增删改在同一事务中更新'''
+    __tablename__ = 'member_daily_summary'
+    __table_args__ = (
+        db.UniqueConstraint('group_id', 'epoch_id', 'day', 'user_id', name='uq_member_daily_summary'),
+    )
+    id = db.Column(db.Integer, primary_key=True, index=True, unique=True, autoincrement=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    epoch_id = db.Column(db.Integer, db.ForeignKey('team_battle_epoch.id'), nullable=False)
+    # 会战日，YYYYMMDD，五点切换
+    day = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    damage = db.Column(db.BigInteger, nullable=False, default=0)
+    score = db.Column(db.BigInteger, nullable=False, default=0)
+    # 出刀数
+    attacks = db.Column(db.Integer, nullable=False, default=0)
+    # 尾刀数
+    last_hits = db.Column(db.Integer, nullable=False, default=0)
+    # 补偿刀数
+    compensation_hits = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<member_daily_summary %r' % self.id
@@ -0,0 +1,42 @@
+"""record hot path indexes
+
+Revision ID: 3f1c2a9d7b10
+Revises:
+Create Date: 2026-10-18 13:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# 已有的数据库是用 db.create_all() 建的，新建的数据库可能已经有这些索引，所以逐个检查
+INDEXES = [
+    ('personal_record', 'ix_personal_record_group_id_detail_date', ['group_id', 'detail_date'], {}),
+    ('personal_record', 'ix_personal_record_group_id_last_modified', ['group_id', 'last_modified'], {}),
+    ('team_record', 'ix_team_record_group_id_last_modified', ['group_id', 'last_modified'], {}),
+    ('deletion_history', 'ix_deletion_history_group_id_from_table_deleted_date',
+     ['group_id', 'from_table', 'deleted_date'], {'mysql_length': {'from_table': 32}}),
+]
+
+
+def _existing_indexes(table: str) -> set:
+    inspector = sa.inspect(op.get_bind())
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    for table, name, columns, kwargs in INDEXES:
+        if name not in _existing_indexes(table):
+            op.create_index(name, table, columns, **kwargs)
+
+
+def downgrade():
+    for table, name, columns, kwargs in reversed(INDEXES):
+        if name in _existing_indexes(table):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,44 @@
+"""outbox
+
+Revision ID: 4c8e1a7f3d92
+Revises: 9b3d6e1f2a48
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8e1a7f3d92'
+down_revision = '9b3d6e1f2a48'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table: str) -> bool:
+    return table in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade():
+    if _has_table('outbox'):
+        return
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('destination', sa.VARCHAR(length=32), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('owner', sa.VARCHAR(length=255), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('claimed_until', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_id', 'outbox', ['id'], unique=True)
+    op.create_index('ix_outbox_claimed_until', 'outbox', ['claimed_until'])
+
+
+def downgrade():
+    if _has_table('outbox'):
+        op.drop_index('ix_outbox_claimed_until', table_name='outbox')
+        op.drop_index('ix_outbox_id', table_name='outbox')
+        op.drop_table('outbox')
@@ -0,0 +1,51 @@
+"""member daily summary
+
+Revision ID: 5a0f7c2d9e64
+Revises: e2b8d05c4f93
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a0f7c2d9e64'
+down_revision = 'e2b8d05c4f93'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table: str) -> bool:
+    return table in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade():
+    # 建表后需要运行 python app.py rebuild_daily_summary 填充已有的记录
+    if _has_table('member_daily_summary'):
+        return
+    op.create_table(
+        'member_daily_summary',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('group_id', sa.Integer(), nullable=False),
+        sa.Column('epoch_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('damage', sa.BigInteger(), nullable=False),
+        sa.Column('score', sa.BigInteger(), nullable=False),
+        sa.Column('attacks', sa.Integer(), nullable=False),
+        sa.Column('last_hits', sa.Integer(), nullable=False),
+        sa.Column('compensation_hits', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['epoch_id'], ['team_battle_epoch.id'], ),
+        sa.ForeignKeyConstraint(['group_id'], ['group.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('group_id', 'epoch_id', 'day', 'user_id', name='uq_member_daily_summary')
+    )
+    op.create_index('ix_member_daily_summary_id', 'member_daily_summary', ['id'], unique=True)
+
+
+def downgrade():
+    if _has_table('member_daily_summary'):
+        op.drop_index('ix_member_daily_summary_id', table_name='member_daily_summary')
+        op.drop_table('member_daily_summary')
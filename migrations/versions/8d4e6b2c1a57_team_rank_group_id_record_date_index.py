@@ -0,0 +1,31 @@
+"""team_rank group_id record_date index
+
+Revision ID: 8d4e6b2c1a57
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-18 14:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4e6b2c1a57'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+
+def _existing_indexes(table: str) -> set:
+    inspector = sa.inspect(op.get_bind())
+    return {index['name'] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    if 'ix_team_rank_group_id_record_date' not in _existing_indexes('team_rank'):
+        op.create_index('ix_team_rank_group_id_record_date', 'team_rank', ['group_id', 'record_date'])
+
+
+def downgrade():
+    if 'ix_team_rank_group_id_record_date' in _existing_indexes('team_rank'):
+        op.drop_index('ix_team_rank_group_id_record_date', table_name='team_rank')
@@ -0,0 +1,72 @@
+"""personal_record battle_day
+
+Revision ID: 9b3d6e1f2a48
+Revises: 5a0f7c2d9e64
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from data.get_date_int import get_battle_day
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3d6e1f2a48'
+down_revision = '5a0f7c2d9e64'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = 'ix_personal_record_group_id_battle_day'
+# 每批回填的行数，内存占用与表的大小无关
+CHUNK_SIZE = 5000
+
+personal_record = sa.table('personal_record',
+                           sa.column('id', sa.Integer),
+                           sa.column('detail_date', sa.DateTime),
+                           sa.column('battle_day', sa.Integer))
+
+
+def _columns(table: str) -> set:
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _indexes(table: str) -> set:
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def _backfill():
+    # 会战日按服务器配置的时区计算，只能在 Python 中算，按 id 分批读取和更新
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.select([personal_record.c.id, personal_record.c.detail_date])
+                            .where(personal_record.c.id > last_id)
+                            .where(personal_record.c.battle_day.is_(None))
+                            .order_by(personal_record.c.id)
+                            .limit(CHUNK_SIZE)).fetchall()
+        if not rows:
+            break
+        bind.execute(personal_record.update()
+                     .where(personal_record.c.id == sa.bindparam('row_id'))
+                     .values(battle_day=sa.bindparam('day')),
+                     [{'row_id': row_id, 'day': get_battle_day(detail_date)} for row_id, detail_date in rows])
+        last_id = rows[-1][0]
+        print('personal_record.battle_day backfilled up to id %d' % last_id)
+
+
+def upgrade():
+    if 'battle_day' not in _columns('personal_record'):
+        op.add_column('personal_record', sa.Column('battle_day', sa.Integer(), nullable=True))
+    _backfill()
+    with op.batch_alter_table('personal_record') as batch_op:
+        batch_op.alter_column('battle_day', existing_type=sa.Integer(), nullable=False)
+    if INDEX_NAME not in _indexes('personal_record'):
+        op.create_index(INDEX_NAME, 'personal_record', ['group_id', 'battle_day', 'detail_date'])
+
+
+def downgrade():
+    if INDEX_NAME in _indexes('personal_record'):
+        op.drop_index(INDEX_NAME, table_name='personal_record')
+    if 'battle_day' in _columns('personal_record'):
+        with op.batch_alter_table('personal_record') as batch_op:
+            batch_op.drop_column('battle_day')
@@ -0,0 +1,32 @@
+"""group data_version
+
+Revision ID: c7a94e3f5b21
+Revises: 8d4e6b2c1a57
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a94e3f5b21'
+down_revision = '8d4e6b2c1a57'
+branch_labels = None
+depends_on = None
+
+
+def _existing_columns(table: str) -> set:
+    inspector = sa.inspect(op.get_bind())
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def upgrade():
+    if 'data_version' not in _existing_columns('group'):
+        op.add_column('group', sa.Column('data_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    if 'data_version' in _existing_columns('group'):
+        with op.batch_alter_table('group') as batch_op:
+            batch_op.drop_column('data_version')
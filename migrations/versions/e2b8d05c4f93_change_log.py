@@ -0,0 +1,46 @@
+"""change log
+
+Revision ID: e2b8d05c4f93
+Revises: c7a94e3f5b21
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8d05c4f93'
+down_revision = 'c7a94e3f5b21'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table: str) -> bool:
+    return table in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade():
+    if _has_table('change_log'):
+        return
+    op.create_table(
+        'change_log',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('group_id', sa.Integer(), nullable=False),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('table_name', sa.VARCHAR(length=32), nullable=False),
+        sa.Column('row_id', sa.Integer(), nullable=False),
+        sa.Column('operation', sa.VARCHAR(length=8), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['group_id'], ['group.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_change_log_id', 'change_log', ['id'], unique=True)
+    op.create_index('ix_change_log_group_id_seq', 'change_log', ['group_id', 'seq'])
+
+
+def downgrade():
+    if _has_table('change_log'):
+        op.drop_index('ix_change_log_group_id_seq', table_name='change_log')
+        op.drop_index('ix_change_log_id', table_name='change_log')
+        op.drop_table('change_log')
@@ -32,6 +32,12 @@ def create_app(config_file=config.Config):
     app.register_blueprint(generate_report_blueprint)
     app.register_blueprint(user_blueprint)
 
+    # 蓝图导入时各目的地已经注册到 dispatcher
+    from .dispatch_tools import dispatcher
+    from .notification_tools import notification_coalescer
+    dispatcher.init_app(app)
+    notification_coalescer.init_app(app)
+
     @app.route('/')
     def hello_world():
         return 'Hello World!'
@@ -4,6 +4,11 @@ from server_app.auth_tools import get_user_with, generate_user_dict
 from data.model import *
 from . import account_blueprint
 from server_app.auth_tools import login_required
+from server_app.push_notification_tools import join_group_tag_later, leave_group_tag_later
+from server_app.record.nickname_tools import invalidate_nickname_index
+from server_app.group_tools import bump_data_version
+from server_app.change_log_tools import log_change
+from server_app.record.summary_tools import rebuild_daily_summary
 
 
 @account_blueprint.route('/link_account', methods=['POST'])
@@ -71,11 +76,17 @@ def link_account():
     if not qq_temp_user.is_temp:
         return jsonify({"msg": "User has already linked to an account."}), 410
 
+    previous_group_id = account_to_link.group_id
     account_to_link.qq = qq_temp_user.qq
     account_to_link.group_id = qq_temp_user.group_id
     account_to_link.nickname = qq_temp_user.nickname
     account_to_link.role = qq_temp_user.role
 
+    record_group_ids = set()
+    for record_id, record_group_id in qq_temp_user.personal_records.with_entities(PersonalRecord.id,
+                                                                                  PersonalRecord.group_id):
+        log_change(record_group_id, 'personal_record', record_id, 'update')
+        record_group_ids.add(record_group_id)
     qq_temp_user.personal_records.update({
         PersonalRecord.last_modified: datetime.datetime.now(),
         PersonalRecord.user_id: account_to_link.id
@@ -85,8 +96,22 @@ def link_account():
         HangOnTree.user_id: account_to_link.id
     })
 
+    # 临时账号的出刀合计转到绑定的账号
+    for group_id in record_group_ids:
+        rebuild_daily_summary(group_id, user_ids=[qq_temp_user.id, account_to_link.id])
+
     db.session.delete(qq_temp_user)
+    for group_id in {previous_group_id, account_to_link.group_id}:
+        bump_data_version(group_id)
     db.session.commit()
+    for group_id in {previous_group_id, account_to_link.group_id}:
+        if group_id:
+            invalidate_nickname_index(group_id)
+    if previous_group_id != account_to_link.group_id:
+        if previous_group_id:
+            leave_group_tag_later(previous_group_id, [account_to_link.username])
+        if account_to_link.group_id:
+            join_group_tag_later(account_to_link.group_id, [account_to_link.username])
 
     user_data = generate_user_dict(user=account_to_link, for_oneself=True)
 
@@ -0,0 +1,70 @@
+from data.model import db, ChangeLog, PersonalRecord, TeamRecord, TeamRank
+from .group_tools import bump_data_version, data_version_of
+from sqlalchemy import event
+from typing import Optional
+import datetime
+
+# 需要记录修改的表
+TRACKED_MODELS = {
+    PersonalRecord: 'personal_record',
+    TeamRecord: 'team_record',
+    TeamRank: 'team_rank'
+}
+
+
+def log_change(group_id: Optional[int], table_name: str, row_id: int, operation: str, session=None):
+    """
+    记录一条修改，事务提交时写入 change_log。
+    通过 Session 增删改的对象会自动记录，只有 bulk_save_objects、Query.update 等绕过 Session 的写入需要手动调用。
+    """
+    if not group_id or group_id <= 0:
+        return
+    session = session if session is not None else db.session
+    session.info.setdefault('pending_changes', list()).append((group_id, table_name, row_id, operation))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changes(session, flush_context):
+    for operation, instances in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for instance in instances:
+            table_name = TRACKED_MODELS.get(type(instance))
+            if table_name is None:
+                continue
+            if operation == 'update' and not session.is_modified(instance, include_collections=False):
+                continue
+            log_change(instance.group_id, table_name, instance.id, operation, session)
+
+
+@event.listens_for(db.session, 'before_commit')
+def _write_change_log(session):
+    session.flush()
+    changes = session.info.pop('pending_changes', None)
+    if not changes:
+        return
+    # 同一行在一个事务中的多次修改只保留一条；先插入后修改仍然算插入
+    operations = dict()
+    for group_id, table_name, row_id, operation in changes:
+        key = (group_id, table_name, row_id)
+        if operations.get(key) == 'insert' and operation == 'update':
+            continue
+        operations[key] = operation
+
+    now = datetime.datetime.now()
+    versions = dict()
+    mappings = list()
+    for (group_id, table_name, row_id), operation in operations.items():
+        if group_id not in versions:
+            bump_data_version(group_id)
+            versions[group_id] = data_version_of(group_id)
+        mappings.append(dict(group_id=group_id, seq=versions[group_id], table_name=table_name,
+                             row_id=row_id, operation=operation, created_at=now))
+    # 一次 executemany 写入，批量出刀时不会逐行 INSERT
+    session.bulk_insert_mappings(ChangeLog, mappings)
+    # 提交后通知本进程中订阅了这些公会的推送流
+    session.info.setdefault('changed_groups', set()).update(versions)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('pending_changes', None)
+    session.info.pop('changed_groups', None)
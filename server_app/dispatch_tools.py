@@ -0,0 +1,226 @@
+from config import Config
+from data.model import db, Outbox
+from typing import Callable, Optional
+from collections import defaultdict
+import datetime
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, destination: str, kwargs: dict, outbox_id: Optional[int] = None, attempts: int = 0):
+        self.destination = destination
+        self.kwargs = kwargs
+        self.outbox_id = outbox_id
+        self.attempts = attempts
+        self.enqueued_at = time.monotonic()
+
+
+class Dispatcher:
+    """
+    后台发送推送、QQ 消息等对外请求，请求线程只负责入队。
+    每个目的地有单独的有界队列和单独的一组后台线程，线程数就是这个目的地的并发上限，
+    一个目的地变慢时不会占住其他目的地的线程。失败后按指数退避重试。
+    开启 persistent 时，入队的请求同时写入 outbox 表，发送成功后删除；
+    进程重启或崩溃后，租约过期的记录会被重新领取发送。
+    """
+
+    def __init__(self, max_size: int, max_attempts: int, backoff: float, persistent: bool, lease: float):
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.persistent = persistent
+        self.lease = lease
+        self._queues = dict()
+        self._handlers = dict()
+        self._concurrency = dict()
+        self._app = None
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(int))
+        self._lag = defaultdict(float)
+        self._max_lag = defaultdict(float)
+
+    def register(self, destination: str, handler: Callable, concurrency: int):
+        with self._start_lock:
+            self._handlers[destination] = handler
+            self._concurrency[destination] = concurrency
+            self._queues[destination] = queue.Queue(maxsize=self.max_size)
+            if self._started_pid == os.getpid():
+                self._start_workers(destination)
+
+    def init_app(self, app):
+        self._app = app
+        if self.persistent:
+            # 不等新的请求入队，启动后立即开始重新发送 outbox 中遗留的记录
+            self._ensure_started()
+            # 应用在 gunicorn --preload 的主进程中创建时，fork 出的 worker 进程也要启动
+            os.register_at_fork(after_in_child=self._ensure_started)
+
+    def enqueue(self, destination: str, **kwargs) -> bool:
+        outbox_id = None
+        if self.persistent:
+            outbox_id = self._save_to_outbox(destination, kwargs)
+        self._ensure_started()
+        return self._put(Job(destination, kwargs, outbox_id=outbox_id))
+
+    def hold(self, destination: str, **kwargs) -> Optional[int]:
+        """
+        只把请求写入 outbox，不入队，由调用者稍后自己发送，发送后用 release 删除。
+        进程在这之前退出时，租约过期后由清扫线程交给 destination 发送。
+        :return: outbox 中的 ID；没有开启 persistent 时为 None
+        """
+        if not self.persistent:
+            return None
+        self._ensure_started()
+        return self._save_to_outbox(destination, kwargs)
+
+    def release(self, outbox_ids: list):
+        outbox_ids = [outbox_id for outbox_id in outbox_ids if outbox_id is not None]
+        if not outbox_ids:
+            return
+        with self._app.app_context():
+            Outbox.query.filter(Outbox.id.in_(outbox_ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+    def metrics(self) -> dict:
+        with self._metrics_lock:
+            destinations = dict()
+            for destination in self._handlers:
+                data = dict(self._counters[destination])
+                data['queue_depth'] = self._queues[destination].qsize()
+                data['last_lag'] = round(self._lag[destination], 3)
+                data['max_lag'] = round(self._max_lag[destination], 3)
+                destinations[destination] = data
+        return {
+            "queue_depth": sum(data['queue_depth'] for data in destinations.values()),
+            "queue_size": self.max_size,
+            "destinations": destinations
+        }
+
+    def _count(self, destination: str, name: str):
+        with self._metrics_lock:
+            self._counters[destination][name] += 1
+
+    def _put(self, job: Job) -> bool:
+        try:
+            self._queues[job.destination].put_nowait(job)
+        except queue.Full:
+            # outbox 中的记录仍然保留，租约过期后会被重新发送
+            logger.warning('Dispatcher queue is full, dropping a job for %s', job.destination)
+            self._count(job.destination, 'dropped')
+            return False
+        self._count(job.destination, 'enqueued')
+        return True
+
+    def _ensure_started(self):
+        # gunicorn fork 之后的每个 worker 进程各自启动后台线程
+        if self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            for destination in self._concurrency:
+                self._queues[destination] = queue.Queue(maxsize=self.max_size)
+                self._start_workers(destination)
+            if self.persistent:
+                threading.Thread(target=self._sweep_outbox, daemon=True).start()
+            self._started_pid = os.getpid()
+
+    def _start_workers(self, destination: str):
+        for _ in range(self._concurrency[destination]):
+            threading.Thread(target=self._work, args=(destination,), daemon=True).start()
+
+    def _work(self, destination: str):
+        jobs = self._queues[destination]
+        while True:
+            job: Job = jobs.get()
+            lag = time.monotonic() - job.enqueued_at
+            with self._metrics_lock:
+                self._lag[destination] = lag
+                self._max_lag[destination] = max(self._max_lag[destination], lag)
+            try:
+                # 处理函数中可能再次入队，开启 persistent 时需要访问数据库
+                with self._app.app_context():
+                    self._handlers[destination](**job.kwargs)
+            except Exception as e:
+                self._retry(job, e)
+            else:
+                self._count(destination, 'sent')
+                self._delete_from_outbox(job)
+
+    def _retry(self, job: Job, error: Exception):
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            logger.error('Giving up sending to %s after %d attempts: %s', job.destination, job.attempts, error)
+            self._count(job.destination, 'failed')
+            self._delete_from_outbox(job)
+            return
+        delay = self.backoff * 2 ** (job.attempts - 1)
+        logger.warning('Sending to %s failed (%s), retrying in %.1fs', job.destination, error, delay)
+        self._count(job.destination, 'retried')
+        job.enqueued_at = time.monotonic() + delay
+        timer = threading.Timer(delay, self._put, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _owner(self) -> str:
+        return socket.gethostname() + ':' + str(os.getpid())
+
+    def _save_to_outbox(self, destination: str, kwargs: dict) -> Optional[int]:
+        """
+        调用时请求本身的修改已经提交，写入失败（例如 outbox 表还没有创建）不能让请求失败，
+        只记录错误并返回 None，这次请求仍然入队发送，只是进程退出时不会被重新发送。
+        """
+        item = Outbox(destination=destination,
+                      payload=json.dumps(kwargs),
+                      owner=self._owner(),
+                      created_at=datetime.datetime.now(),
+                      claimed_until=datetime.datetime.now() + datetime.timedelta(seconds=self.lease))
+        try:
+            db.session.add(item)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error('Failed to save a job for %s to outbox: %s', destination, e)
+            return None
+        return item.id
+
+    def _delete_from_outbox(self, job: Job):
+        self.release([job.outbox_id])
+
+    def _sweep_outbox(self):
+        # 领取租约已过期的记录（原进程已退出或发送失败），领取通过带条件的 UPDATE 完成，不会被重复领取
+        while True:
+            try:
+                with self._app.app_context():
+                    now = datetime.datetime.now()
+                    expired = Outbox.query.filter(Outbox.claimed_until < now,
+                                                  Outbox.destination.in_(list(self._handlers))) \
+                        .limit(self.max_size).all()
+                    for item in expired:
+                        claimed = Outbox.query.filter(Outbox.id == item.id, Outbox.claimed_until == item.claimed_until) \
+                            .update({Outbox.owner: self._owner(),
+                                     Outbox.claimed_until: now + datetime.timedelta(seconds=self.lease)},
+                                    synchronize_session=False)
+                        db.session.commit()
+                        if claimed:
+                            self._put(Job(item.destination, json.loads(item.payload), outbox_id=item.id))
+            except Exception as e:
+                logger.error('Failed to sweep outbox: %s', e)
+            time.sleep(self.lease)
+
+
+dispatcher = Dispatcher(max_size=getattr(Config, 'DISPATCHER_QUEUE_SIZE', 1000),
+                        max_attempts=getattr(Config, 'DISPATCHER_MAX_ATTEMPTS', 5),
+                        backoff=getattr(Config, 'DISPATCHER_BACKOFF', 1.0),
+                        persistent=getattr(Config, 'DISPATCHER_PERSISTENT', False),
+                        lease=getattr(Config, 'DISPATCHER_LEASE', 300))
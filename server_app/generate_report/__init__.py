@@ -7,3 +7,4 @@ generate_report_blueprint = Blueprint(
 )
 
 from .generate_report import *
+from .export import *
@@ -0,0 +1,62 @@
+from . import generate_report_blueprint
+from .generate_report import verify_signed_url
+from .export_tools import EXPORT_TABLES, EXPORT_FORMATS, export_rows, iter_csv, iter_ndjson
+from flask import jsonify, request, Response, stream_with_context
+import datetime
+
+
+@generate_report_blueprint.route('/export', methods=['GET'])
+def export():
+    """
+    @api {get} /v1/generate_report/export 导出原始数据（CSV/NDJSON）
+    @apiVersion 1.0.0
+    @apiName export
+    @apiGroup GenerateReport
+    @apiParam {String}  auth        (必须)    与 generate 返回的 url 中的 auth 相同
+    @apiParam {String}  format      (可选)    csv（默认）/ndjson
+    @apiParam {String}  table       (可选)    personal：个人出刀记录（默认）/team_rank：公会排名记录
+    @apiParam {int}     epoch_id    (可选)    只导出这一期会战
+    @apiParam {int}     start_date  (可选)    开始日期时间戳（秒）
+    @apiParam {int}     end_date    (可选)    结束日期时间戳（秒）
+    @apiParam {int}     user_id     (可选)    只导出这个成员的出刀，仅用于 personal
+    @apiDescription 从数据库逐批读取并立即输出，按时间排序。CSV 第一行为列名，NDJSON 每行一条记录，时间为秒级时间戳。
+
+    @apiSuccess (回参) {File} Attachment  导出的文件
+
+    @apiErrorExample {json} 参数不合法
+        HTTP/1.1 400 Bad Request
+        {"msg": "Illegal parameter."}
+
+    @apiErrorExample {json} 签名不正确
+        HTTP/1.1 401 Unauthorized
+        {"msg": "Auth sign does not verify"}
+    """
+    format_: str = request.args.get('format', 'csv')
+    table: str = request.args.get('table', 'personal')
+    epoch_id: str = request.args.get('epoch_id', '')
+    start_date: str = request.args.get('start_date', '')
+    end_date: str = request.args.get('end_date', '')
+    user_id: str = request.args.get('user_id', '')
+
+    if format_ not in EXPORT_FORMATS or table not in EXPORT_TABLES:
+        return jsonify({"msg": "Illegal parameter."}), 400
+    for value in (epoch_id, start_date, end_date, user_id):
+        if value and not value.isdigit():
+            return jsonify({"msg": "Illegal parameter."}), 400
+
+    _, group, error = verify_signed_url()
+    if error is not None:
+        return error
+
+    keys, rows = export_rows(table, group.id,
+                             epoch_id=int(epoch_id) if epoch_id else None,
+                             start=datetime.datetime.fromtimestamp(int(start_date)) if start_date else None,
+                             end=datetime.datetime.fromtimestamp(int(end_date)) if end_date else None,
+                             user_id=int(user_id) if user_id else None)
+    chunks = iter_csv(keys, rows) if format_ == 'csv' else iter_ndjson(keys, rows)
+    headers = {
+        'Content-Disposition': f'attachment; filename=group-{group.id}-{table}.{format_}',
+        # 让反向代理不缓冲，数据生成后立即发给客户端
+        'X-Accel-Buffering': 'no',
+    }
+    return Response(stream_with_context(chunks), 200, mimetype=EXPORT_FORMATS[format_], headers=headers)
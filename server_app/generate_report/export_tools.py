@@ -0,0 +1,79 @@
+from data.model import db, PersonalRecord, TeamRank
+from config import Config
+from typing import Iterator, Optional
+import csv
+import datetime
+import io
+import json
+import time
+
+# 每次从服务器端游标读取、每次输出的行数
+EXPORT_BATCH_SIZE = getattr(Config, 'EXPORT_BATCH_SIZE', 1000)
+
+# 可以导出的表：(model, 时间列)
+EXPORT_TABLES = {
+    'personal': (PersonalRecord, PersonalRecord.detail_date),
+    'team_rank': (TeamRank, TeamRank.record_date),
+}
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_rows(table: str, group_id: int, epoch_id: Optional[int] = None,
+                start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None,
+                user_id: Optional[int] = None):
+    """
+    :return: (列名, 逐批读取的行)，行为各列的值，顺序与列名相同
+    """
+    model, date_column = EXPORT_TABLES[table]
+    columns = list(model.__table__.columns)
+    query = db.session.query(*columns).filter(model.group_id == group_id)
+    if epoch_id is not None:
+        query = query.filter(model.epoch_id == epoch_id)
+    if start is not None:
+        query = query.filter(date_column >= start)
+    if end is not None:
+        query = query.filter(date_column <= end)
+    if user_id is not None and model is PersonalRecord:
+        query = query.filter(PersonalRecord.user_id == user_id)
+    # 按 (group_id, 时间) 索引的顺序读取，yield_per 使用服务器端游标，不会一次读出所有结果
+    query = query.order_by(date_column, model.id).yield_per(EXPORT_BATCH_SIZE)
+    return [column.key for column in columns], query
+
+
+def _timestamps(row) -> list:
+    # 时间与其他接口相同，为秒级时间戳
+    return [int(time.mktime(value.timetuple())) if isinstance(value, datetime.date) else value for value in row]
+
+
+def iter_csv(keys: list, rows) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(keys)
+    # 先输出列名，客户端立即开始收到数据
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    count = 0
+    for row in rows:
+        writer.writerow(_timestamps(row))
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(keys: list, rows) -> Iterator[str]:
+    batch = list()
+    for row in rows:
+        batch.append(json.dumps(dict(zip(keys, _timestamps(row))), ensure_ascii=False) + '\n')
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield ''.join(batch)
+            batch = list()
+    if batch:
+        yield ''.join(batch)
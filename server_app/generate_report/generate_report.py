@@ -1,12 +1,38 @@
 from . import generate_report_blueprint
 from server_app.auth_tools import login_required, sign, get_user_with
 from flask import g, jsonify, request, send_file
-from .generate_report_tool import make_xlsx_for_group
+from .report_cache_tools import cached_report
+from .report_job_tools import report_jobs, read_status
 from config import Config
 import jwt
 import datetime
 
 
+def verify_signed_url() -> tuple:
+    """
+    验证 generate 返回的 URL 中的 auth 参数。
+    :return: (JWT 内容, 用户的公会, 错误时的返回值)
+    """
+    auth_header = request.args.get('auth', None)
+    if not auth_header:
+        return None, None, jsonify({'msg': 'You must provide a auth header.'})
+    try:
+        decode_jwt = jwt.decode(auth_header,
+                                Config.SECRET_KEY,
+                                algorithms=['HS256'],
+                                audience=Config.DOMAIN_NAME)
+    except jwt.exceptions.InvalidTokenError:
+        return None, None, (jsonify({"msg": "Auth sign does not verify"}), 401)
+    user_id = decode_jwt.get('user_id', None)
+    user = get_user_with(id_=user_id)
+    if not user:
+        return None, None, (jsonify({"msg": "User not found."}), 402)
+    group = user.group
+    if not group:
+        return None, None, jsonify({'msg': 'User does not have a group'})
+    return decode_jwt, group, None
+
+
 @generate_report_blueprint.route('/generate', methods=['GET'])
 @login_required
 def generate():
@@ -15,33 +41,81 @@ def generate():
     @apiVersion 1.0.0
     @apiName generate
     @apiGroup GenerateReport
+    @apiDescription 提交一个在后台生成报告的任务。公会数据没有变化时返回同一个任务，报告已经生成时 status 直接为 done。
+    通过 status 查询进度，status 为 done 之后 url 才可以下载。
 
-    @apiSuccess (回参) {String} msg   为"Successful!"
-    @apiSuccess (回参) {String} url   获取报告的URL
+    @apiSuccess (回参) {String} msg       为"Successful!"
+    @apiSuccess (回参) {String} job_id    任务ID
+    @apiSuccess (回参) {String} status    pending：排队中/running：生成中/done：已完成/failed：失败
+    @apiSuccess (回参) {int}    progress  进度百分比
+    @apiSuccess (回参) {String} url       获取报告的URL
     @apiSuccessExample {json} 成功样例
         HTTP/1.1 200 OK
         {
             "msg": "Successful!",
+            "job_id": "233-0123456789abcdef0123456789abcdef",
+            "status": "pending",
+            "progress": 0,
             "url": "https://dd.works:5555/v1/generate_report/download?auth=xxx",
         }
+
+    @apiErrorExample {json} 报告任务过多
+        HTTP/1.1 503 Service Unavailable
+        {"msg": "Too many report jobs."}
     """
     group = g.user.group
     if not group:
         return jsonify({'msg': 'User does not have a group'})
+    status = report_jobs.submit(group_id=group.id, data_version=group.data_version)
+    if status is None:
+        return jsonify({"msg": "Too many report jobs."}), 503
     auth_dict = {
         'user_id': g.user.id,
+        'job_id': status['job_id'],
         "iss": Config.DOMAIN_NAME,
         "aud": Config.FRONTEND_DOMAIN_NAME,
         "iat": int(datetime.datetime.now().timestamp()),
     }
     signed = sign(auth_dict)
-    print(signed)
     return jsonify({
         "msg": "Successful!",
+        "job_id": status['job_id'],
+        "status": status['status'],
+        "progress": status['progress'],
         "url": Config.SELF_URL + '/v1/generate_report/download?auth=' + signed
     })
 
 
+@generate_report_blueprint.route('/status', methods=['GET'])
+@login_required
+def report_status():
+    """
+    @api {get} /v1/generate_report/status 查询报告任务的进度
+    @apiVersion 1.0.0
+    @apiName report_status
+    @apiGroup GenerateReport
+    @apiParam {String}  job_id   (必须)    generate 返回的任务ID
+
+    @apiSuccess (回参) {String} msg       为"Successful!"
+    @apiSuccess (回参) {String} job_id    任务ID
+    @apiSuccess (回参) {String} status    pending：排队中/running：生成中/done：已完成/failed：失败
+    @apiSuccess (回参) {int}    progress  进度百分比
+
+    @apiErrorExample {json} 任务不存在或报告已过期
+        HTTP/1.1 404 Not Found
+        {"msg": "Job not found."}
+    """
+    status = read_status(request.args.get('job_id', ''))
+    if status is None or status['group_id'] != g.user.group_id:
+        return jsonify({"msg": "Job not found."}), 404
+    return jsonify({
+        "msg": "Successful!",
+        "job_id": status['job_id'],
+        "status": status['status'],
+        "progress": status['progress']
+    }), 200
+
+
 @generate_report_blueprint.route('/download', methods=['GET'])
 def report_download():
     """
@@ -49,26 +123,31 @@ def report_download():
     @apiVersion 1.0.0
     @apiName report_download
     @apiGroup GenerateReport
+    @apiDescription 任务完成之前返回 202 和当前进度。
 
     @apiSuccess (回参) {File} Attachment  生成的xlsx文件
+
+    @apiErrorExample {json} 报告还没有生成
+        HTTP/1.1 202 Accepted
+        {"msg": "Report is not ready.", "status": "running", "progress": 42}
+
+    @apiErrorExample {json} 任务不存在或报告已过期
+        HTTP/1.1 404 Not Found
+        {"msg": "Job not found."}
+
+    @apiErrorExample {json} 报告生成失败
+        HTTP/1.1 500 Internal Server Error
+        {"msg": "Report generation failed."}
     """
-    auth_header = request.args.get('auth', None)
-    print(auth_header)
-    if not auth_header:
-        return jsonify({'msg': 'You must provide a auth header.'})
-    try:
-        decode_jwt = jwt.decode(auth_header,
-                                Config.SECRET_KEY,
-                                algorithms=['HS256'],
-                                audience=Config.DOMAIN_NAME)
-    except jwt.exceptions.InvalidTokenError:
-        return jsonify({"msg": "Auth sign does not verify"}), 401
-    user_id = decode_jwt.get('user_id', None)
-    user = get_user_with(id_=user_id)
-    if not user:
-        return jsonify({"msg": "User not found."}), 402
-    group = user.group
-    if not group:
-        return jsonify({'msg': 'User does not have a group'})
-    make_xlsx_for_group(group_id=group.id)
-    return send_file(f'temp\\group-{group.id}-report.xlsx', as_attachment=True)
+    decode_jwt, group, error = verify_signed_url()
+    if error is not None:
+        return error
+    status = read_status(decode_jwt.get('job_id', None))
+    if status is None or status['group_id'] != group.id:
+        return jsonify({"msg": "Job not found."}), 404
+    if status['status'] == 'failed':
+        return jsonify({"msg": "Report generation failed."}), 500
+    path = cached_report(status['job_id']) if status['status'] == 'done' else None
+    if path is None:
+        return jsonify({"msg": "Report is not ready.", "status": status['status'], "progress": status['progress']}), 202
+    return send_file(path, as_attachment=True, attachment_filename=f'group-{group.id}-report.xlsx')
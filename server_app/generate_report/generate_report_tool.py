@@ -1,14 +1,193 @@
 from datetime import datetime
 import xlsxwriter
-from data.model import PersonalRecord
+import numpy as np
+from data.model import db, PersonalRecord, User
+from sqlalchemy import func, case
+from config import Config
+from collections import namedtuple
+from itertools import islice
+from typing import Callable, Iterator, Optional
 import os
 
+# 每次从数据库读取的行数
+REPORT_BATCH_SIZE = getattr(Config, 'REPORT_BATCH_SIZE', 1000)
+# 报告中的列，按 Excel 中的顺序
+REPORT_COLUMNS = (PersonalRecord.detail_date, PersonalRecord.nickname, PersonalRecord.boss_gen,
+                  PersonalRecord.boss_order, PersonalRecord.damage, PersonalRecord.score, PersonalRecord.type)
 
-def make_xlsx_for_group(group_id: int):
+
+def iter_report_rows(group_id: int):
+    # 只读取报告需要的列，分批从数据库中读出，不构造 ORM 对象
+    return db.session.query(*REPORT_COLUMNS) \
+        .filter(PersonalRecord.group_id == group_id) \
+        .order_by(PersonalRecord.detail_date, PersonalRecord.id) \
+        .yield_per(REPORT_BATCH_SIZE)
+
+
+# 透视表中出刀类型的编号，其余为普通刀（0）
+TYPE_CODES = {'last': 1, 'compensation': 2}
+PIVOT_COLUMNS = ('user_id', 'battle_day', 'boss_order', 'damage', 'score', 'type')
+BOSS_COUNT = len(Config.BOSS_HEALTH)
+
+Pivots = namedtuple('Pivots', ['members', 'days', 'day_damage', 'day_score', 'day_attacks',
+                               'boss_attacks', 'boss_average', 'attacks', 'last_hits', 'compensation_hits'])
+
+
+def iter_pivot_chunks(group_id: int) -> Iterator[np.ndarray]:
+    """
+    逐批读出透视表需要的列，每批为 (行数, len(PIVOT_COLUMNS)) 的 NumPy 整数数组。
+    """
+    rows = iter(db.session.query(func.coalesce(PersonalRecord.user_id, 0),
+                                 PersonalRecord.battle_day,
+                                 PersonalRecord.boss_order,
+                                 PersonalRecord.damage,
+                                 PersonalRecord.score,
+                                 case([(PersonalRecord.type == name, code) for name, code in TYPE_CODES.items()],
+                                      else_=0))
+                .filter(PersonalRecord.group_id == group_id)
+                .yield_per(REPORT_BATCH_SIZE))
+    while True:
+        chunk = list(islice(rows, REPORT_BATCH_SIZE * 10))
+        if not chunk:
+            return
+        yield np.array(chunk, dtype=np.int64)
+
+
+class PivotAccumulator:
+    """
+    逐批累加透视表：每批记录用 bincount（指定 minlength）一次加到 成员×会战日、成员×Boss 和每个成员的合计上，不逐条循环。
+    只保存合计，不保存记录的列，内存只与成员数和会战日数有关，与记录数无关。
+    """
+
+    def __init__(self):
+        # 成员 ID / 会战日 -> 矩阵中的行号 / 列号，按第一次出现的顺序编号
+        self._members = dict()
+        self._days = dict()
+        self.day_damage = np.zeros((0, 0))
+        self.day_score = np.zeros((0, 0))
+        self.day_attacks = np.zeros((0, 0), dtype=np.int64)
+        self.boss_attacks = np.zeros((0, BOSS_COUNT), dtype=np.int64)
+        self.boss_damage = np.zeros((0, BOSS_COUNT))
+        self.attacks = np.zeros(0, dtype=np.int64)
+        self.last_hits = np.zeros(0)
+        self.compensation_hits = np.zeros(0)
+
+    @staticmethod
+    def _index(ids: dict, values: np.ndarray) -> np.ndarray:
+        unique, inverse = np.unique(values, return_inverse=True)
+        codes = np.array([ids.setdefault(value, len(ids)) for value in unique.tolist()], dtype=np.int64)
+        return codes[inverse]
+
+    def _grow(self):
+        # 出现了新的成员或会战日时，在合计矩阵的末尾补零
+        members, days = len(self._members), len(self._days)
+        for name in ('day_damage', 'day_score', 'day_attacks', 'boss_attacks', 'boss_damage',
+                     'attacks', 'last_hits', 'compensation_hits'):
+            matrix = getattr(self, name)
+            padding = [(0, members - matrix.shape[0])]
+            if matrix.ndim == 2:
+                padding.append((0, days - matrix.shape[1]) if name.startswith('day_') else (0, 0))
+            setattr(self, name, np.pad(matrix, padding))
+
+    def add(self, chunk: np.ndarray):
+        member_index = self._index(self._members, chunk[:, 0])
+        day_index = self._index(self._days, chunk[:, 1])
+        self._grow()
+        members, days = len(self._members), len(self._days)
+        damage = chunk[:, 3].astype(np.float64)
+        type_ = chunk[:, 5]
+
+        day_cells = member_index * days + day_index
+
+        def per_day(weights=None) -> np.ndarray:
+            return np.bincount(day_cells, weights=weights, minlength=members * days).reshape(members, days)
+
+        self.day_damage += per_day(damage)
+        self.day_score += per_day(chunk[:, 4].astype(np.float64))
+        self.day_attacks += per_day()
+
+        boss_cells = member_index * BOSS_COUNT + np.clip(chunk[:, 2], 1, BOSS_COUNT) - 1
+        self.boss_attacks += np.bincount(boss_cells, minlength=members * BOSS_COUNT).reshape(members, BOSS_COUNT)
+        self.boss_damage += np.bincount(boss_cells, weights=damage,
+                                        minlength=members * BOSS_COUNT).reshape(members, BOSS_COUNT)
+
+        self.attacks += np.bincount(member_index, minlength=members)
+        self.last_hits += np.bincount(member_index, weights=type_ == TYPE_CODES['last'], minlength=members)
+        self.compensation_hits += np.bincount(member_index, weights=type_ == TYPE_CODES['compensation'],
+                                              minlength=members)
+
+    def result(self) -> Pivots:
+        # 成员按 ID、会战日按日期排序
+        members = np.array(list(self._members), dtype=np.int64)
+        days = np.array(list(self._days), dtype=np.int64)
+        member_order, day_order = np.argsort(members), np.argsort(days)
+        boss_average = np.divide(self.boss_damage, self.boss_attacks,
+                                 out=np.zeros(self.boss_damage.shape), where=self.boss_attacks > 0)
+        return Pivots(members=members[member_order],
+                      days=days[day_order],
+                      day_damage=self.day_damage[member_order][:, day_order],
+                      day_score=self.day_score[member_order][:, day_order],
+                      day_attacks=self.day_attacks[member_order][:, day_order],
+                      boss_attacks=self.boss_attacks[member_order],
+                      boss_average=boss_average[member_order],
+                      attacks=self.attacks[member_order],
+                      last_hits=self.last_hits[member_order],
+                      compensation_hits=self.compensation_hits[member_order])
+
+
+def compute_pivots(group_id: int) -> Pivots:
+    accumulator = PivotAccumulator()
+    for chunk in iter_pivot_chunks(group_id):
+        accumulator.add(chunk)
+    return accumulator.result()
+
+
+def _write_table(worksheet, header: list, labels: list, matrix: np.ndarray, bold, number_format=None):
+    # constant_memory 模式下逐行写入
+    worksheet.set_column(0, 0, 20)
+    worksheet.write_row(0, 0, header, bold)
+    for row, (label, values) in enumerate(zip(labels, matrix.tolist()), start=1):
+        worksheet.write_string(row, 0, label)
+        worksheet.write_row(row, 1, values, number_format)
+
+
+def write_pivot_sheets(workbook, group_id: int, bold):
+    pivots = compute_pivots(group_id)
+    nicknames = dict(User.query.with_entities(User.id, User.nickname)
+                     .filter(User.id.in_(pivots.members.tolist())).all()) if len(pivots.members) else dict()
+    labels = [nicknames.get(user_id, '#' + str(user_id)) if user_id else '未知' for user_id in pivots.members.tolist()]
+    days = ['%d-%02d-%02d' % (day // 10000, day // 100 % 100, day % 100) for day in pivots.days.tolist()]
+    integer_format = workbook.add_format({'num_format': '0'})
+
+    for name, matrix in (('每日伤害', pivots.day_damage), ('每日分数', pivots.day_score),
+                         ('每日出刀数', pivots.day_attacks)):
+        total = matrix.sum(axis=1, keepdims=True)
+        _write_table(workbook.add_worksheet(name), ['成员'] + days + ['合计'], labels,
+                     np.hstack([matrix, total]), bold, integer_format)
+
+    bosses = range(1, BOSS_COUNT + 1)
+    _write_table(workbook.add_worksheet('Boss统计'),
+                 ['成员'] + ['%d王出刀数' % boss for boss in bosses] + ['%d王平均伤害' % boss for boss in bosses],
+                 labels, np.hstack([pivots.boss_attacks, pivots.boss_average]), bold, integer_format)
+
+    damage = pivots.day_damage.sum(axis=1)
+    average = np.divide(damage, pivots.attacks, out=np.zeros(len(damage)), where=pivots.attacks > 0)
+    _write_table(workbook.add_worksheet('成员统计'),
+                 ['成员', '出刀数', '尾刀数', '补偿刀数', '总伤害', '总分数', '平均伤害'], labels,
+                 np.column_stack([pivots.attacks, pivots.last_hits, pivots.compensation_hits,
+                                  damage, pivots.day_score.sum(axis=1), average]), bold, integer_format)
+
+
+def make_xlsx_for_group(group_id: int, path: str, progress: Optional[Callable[[int], None]] = None) -> str:
+    """
+    生成公会的出刀报告，写入 path：出刀记录和按成员汇总的透视表。
+    记录逐批读取，工作簿使用 constant_memory 模式，每写完一行就写入临时文件，内存占用与记录数无关。
+    :param progress: 每写完一批记录调用一次，参数为已经写入的记录数
+    :return: 生成的文件路径
+    """
     # Create a workbook and add a worksheet.
-    records = PersonalRecord.query.filter(PersonalRecord.group_id == group_id).all()
-    workbook = xlsxwriter.Workbook(os.path.join('server_app', 'temp', f'group-{group_id}-report.xlsx'))
-    worksheet = workbook.add_worksheet()
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('出刀记录')
 
     # Add a bold format to use to highlight cells.
     bold = workbook.add_format({'bold': 1})
@@ -30,17 +209,109 @@ def make_xlsx_for_group(group_id: int):
     worksheet.write('G1', '出刀类型', bold)
 
     # Start from the first cell below the headers.
+    # constant_memory 模式下必须按行的顺序写入
     row = 1
 
-    record: PersonalRecord
-    for record in records:
-        worksheet.write_datetime(row, 0, record.detail_date, date_format)
-        worksheet.write_string(row, 1, record.nickname)
-        worksheet.write(row, 2, record.boss_gen)
-        worksheet.write(row, 3, record.boss_order)
-        worksheet.write(row, 4, record.damage)
-        worksheet.write(row, 5, record.score)
-        worksheet.write_string(row, 6, record.type)
+    for detail_date, nickname, boss_gen, boss_order, damage, score, type_ in iter_report_rows(group_id):
+        worksheet.write_datetime(row, 0, detail_date, date_format)
+        worksheet.write_string(row, 1, nickname)
+        worksheet.write_number(row, 2, boss_gen)
+        worksheet.write_number(row, 3, boss_order)
+        worksheet.write_number(row, 4, damage)
+        worksheet.write_number(row, 5, score)
+        worksheet.write_string(row, 6, type_)
+        if progress is not None and row % REPORT_BATCH_SIZE == 0:
+            progress(row)
         row += 1
 
-    workbook.close()
\ No newline at end of file
+    # 成员×会战日、成员×Boss 等透视表
+    write_pivot_sheets(workbook, group_id, bold)
+
+    workbook.close()
+    return path
+
+
+if __name__ == '__main__':
+    # 基准测试：python -m server_app.generate_report.generate_report_tool [行数 ...]
+    # 每个规模在单独的进程中生成报告，报告该进程的耗时和峰值内存（RSS）
+    import resource
+    import sqlalchemy
+    import sqlite3
+    import subprocess
+    import sys
+    import tempfile
+    import time
+    from datetime import timedelta
+
+    def peak_rss_mb() -> float:
+        # Linux 上 ru_maxrss 的单位为 KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def make_database(path: str, rows: int):
+        db.metadata.create_all(sqlalchemy.create_engine('sqlite:///' + path),
+                               tables=[PersonalRecord.__table__, User.__table__])
+        connection = sqlite3.connect(path)
+        start = datetime(2020, 1, 1)
+
+        def generate():
+            for i in range(rows):
+                detail_date = start + timedelta(seconds=30 * i)
+                yield (1, i // 5 % 20 + 1, i % 5 + 1, 1000000 + i, 1200000 + i, i % 30 + 1, 'キョウカ' + str(i % 30),
+                       detail_date, int(detail_date.strftime('%Y%m%d')), ('normal', 'last', 'compensation')[i % 5 % 3],
+                       1, detail_date)
+        connection.executemany('INSERT INTO personal_record (group_id, boss_gen, boss_order, damage, score, user_id, '
+                               'nickname, detail_date, battle_day, type, epoch_id, last_modified) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', generate())
+        connection.commit()
+        connection.close()
+
+    def generate_report(database: str, legacy: bool):
+        from server_app import create_app
+        app = create_app()
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+        with app.app_context():
+            output = database + '.xlsx'
+            baseline = peak_rss_mb()
+            started = time.perf_counter()
+            if legacy:
+                # 原来的实现：一次读出所有记录，工作簿全部保存在内存中
+                workbook = xlsxwriter.Workbook(output)
+                worksheet = workbook.add_worksheet()
+                records = PersonalRecord.query.filter(PersonalRecord.group_id == 1).all()
+                for row, record in enumerate(records, start=1):
+                    worksheet.write_datetime(row, 0, record.detail_date)
+                    worksheet.write_string(row, 1, record.nickname)
+                    worksheet.write(row, 2, record.boss_gen)
+                    worksheet.write(row, 3, record.boss_order)
+                    worksheet.write(row, 4, record.damage)
+                    worksheet.write(row, 5, record.score)
+                    worksheet.write_string(row, 6, record.type)
+                workbook.close()
+                pivot = '-'
+            else:
+                make_xlsx_for_group(1, output)
+            seconds, rss = time.perf_counter() - started, peak_rss_mb() - baseline
+            if not legacy:
+                # 单独计算透视表（逐批读取 + bincount）的耗时
+                started = time.perf_counter()
+                compute_pivots(1)
+                pivot = '%.2f' % (time.perf_counter() - started)
+            print('%.2f %.1f %s' % (seconds, rss, pivot))
+
+    if len(sys.argv) == 4 and sys.argv[1] == '--run':
+        generate_report(sys.argv[2], sys.argv[3] == 'legacy')
+        sys.exit(0)
+
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000, 1000000]
+    print('%10s  %-9s %9s %12s %9s' % ('rows', 'mode', 'seconds', 'RSS +MB', 'pivots'))
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, 'report.db')
+            make_database(database, size)
+            for mode in ('legacy', 'streaming'):
+                output = subprocess.run([sys.executable, '-W', 'ignore::RuntimeWarning',
+                                         '-m', 'server_app.generate_report.generate_report_tool',
+                                         '--run', database, mode],
+                                        stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+                seconds, rss, pivot = output.split()[-3:]
+                print('%10d  %-9s %9s %12s %9s' % (size, mode, seconds, rss, pivot))
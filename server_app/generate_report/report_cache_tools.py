@@ -0,0 +1,96 @@
+from .generate_report_tool import make_xlsx_for_group
+from config import Config
+from typing import Callable, Optional
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# 报告格式的版本，修改报告内容后增加，旧格式的缓存不再使用
+REPORT_FORMAT_VERSION = 2
+REPORT_CACHE_DIR = getattr(Config, 'REPORT_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'temp', 'reports'))
+# 缓存目录的总大小上限，超过后删除最久没有使用的报告
+REPORT_CACHE_MAX_BYTES = getattr(Config, 'REPORT_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+# 进程中途退出时留下的临时文件和过期的任务状态文件，超过这个时间（秒）后删除
+STALE_TEMP_SECONDS = 24 * 3600
+
+_eviction_lock = threading.Lock()
+
+
+def report_key(group_id: int, data_version: int, options: Optional[dict] = None) -> str:
+    """
+    报告的内容只取决于公会的数据版本和报告选项，相同的键对应相同的文件。
+    """
+    content = json.dumps([REPORT_FORMAT_VERSION, group_id, data_version, options or {}], sort_keys=True)
+    return '%d-%s' % (group_id, hashlib.sha256(content.encode()).hexdigest()[:32])
+
+
+def report_path(key: str) -> str:
+    return os.path.join(REPORT_CACHE_DIR, key + '.xlsx')
+
+
+def cached_report(key: str) -> Optional[str]:
+    path = report_path(key)
+    try:
+        # 修改时间作为最近使用时间，用于淘汰
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def get_report(group_id: int, data_version: int, options: Optional[dict] = None,
+               progress: Optional[Callable[[int], None]] = None) -> str:
+    """
+    返回公会报告的路径，数据没有变化时直接使用缓存的文件。
+    报告先写入临时文件再重命名，同时下载的请求不会读到写了一半的文件。
+    """
+    key = report_key(group_id, data_version, options)
+    path = cached_report(key)
+    if path is not None:
+        return path
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=REPORT_CACHE_DIR, prefix=key + '-', suffix='.tmp')
+    os.close(fd)
+    try:
+        make_xlsx_for_group(group_id, temp_path, progress=progress)
+        os.replace(temp_path, report_path(key))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    evict_reports(keep=key)
+    return report_path(key)
+
+
+def evict_reports(keep: Optional[str] = None, max_bytes: int = REPORT_CACHE_MAX_BYTES):
+    """
+    按最近使用时间淘汰缓存的报告，直到总大小不超过 max_bytes。
+    """
+    with _eviction_lock:
+        entries = list()
+        now = time.time()
+        for entry in os.scandir(REPORT_CACHE_DIR):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if entry.name.endswith('.xlsx'):
+                entries.append((stat.st_mtime, stat.st_size, entry))
+            elif entry.name.endswith(('.tmp', '.json')) and now - stat.st_mtime > STALE_TEMP_SECONDS:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda item: item[0]):
+            if total <= max_bytes:
+                break
+            if entry.name == (keep or '') + '.xlsx':
+                continue
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,126 @@
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from data.model import db, PersonalRecord
+from .report_cache_tools import REPORT_CACHE_DIR, report_key, cached_report, get_report
+from config import Config
+from typing import Optional
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_PATTERN = re.compile(r'^\d+-[0-9a-f]{32}$')
+
+
+def status_path(job_id: str) -> str:
+    return os.path.join(REPORT_CACHE_DIR, job_id + '.json')
+
+
+def write_status(job_id: str, group_id: int, status: str, progress: int, error: Optional[str] = None) -> dict:
+    """
+    任务状态写入缓存目录中的 JSON 文件，所有 worker 进程都能读到。
+    """
+    data = dict(job_id=job_id, group_id=group_id, status=status, progress=progress, updated_at=time.time())
+    if error is not None:
+        data['error'] = error
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=REPORT_CACHE_DIR, prefix=job_id + '-', suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(data, file)
+    os.replace(temp_path, status_path(job_id))
+    return data
+
+
+def read_status(job_id: str) -> Optional[dict]:
+    """
+    :return: 任务状态，status 为 pending/running/done/failed；任务不存在时为 None
+    """
+    if not JOB_ID_PATTERN.match(job_id or ''):
+        return None
+    if cached_report(job_id) is not None:
+        return dict(job_id=job_id, group_id=int(job_id.split('-')[0]), status='done', progress=100)
+    try:
+        with open(status_path(job_id)) as file:
+            data = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if data['status'] == 'done':
+        # 报告已经被淘汰
+        return None
+    return data
+
+
+class ReportJobs:
+    """
+    在后台线程池中生成报告，请求线程只负责提交任务。
+    任务 ID 就是报告的缓存键，公会数据没有变化时重复提交会得到同一个任务。
+    同时排队和执行的任务数有上限，报告请求过多时直接拒绝，不会占满数据库连接影响出刀接口。
+    """
+
+    def __init__(self, workers: int, max_jobs: int, timeout: float):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self._executor = None
+        self._started_pid = None
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def submit(self, group_id: int, data_version: int, options: Optional[dict] = None) -> Optional[dict]:
+        """
+        :return: 任务状态；任务数已满时为 None
+        """
+        job_id = report_key(group_id, data_version, options)
+        status = read_status(job_id)
+        if status is not None and (status['status'] == 'done' or (
+                status['status'] in ('pending', 'running') and time.time() - status['updated_at'] < self.timeout)):
+            return status
+        with self._lock:
+            executor = self._get_executor()
+            if self._active >= self.max_jobs:
+                return None
+            self._active += 1
+        status = write_status(job_id, group_id, 'pending', 0)
+        executor.submit(self._run, current_app._get_current_object(), job_id, group_id, data_version, options)
+        return status
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # gunicorn fork 之后的每个 worker 进程各自创建线程池
+        if self._started_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            self._active = 0
+            self._started_pid = os.getpid()
+        return self._executor
+
+    def _run(self, app, job_id: str, group_id: int, data_version: int, options: Optional[dict]):
+        try:
+            with app.app_context():
+                try:
+                    write_status(job_id, group_id, 'running', 0)
+                    total = PersonalRecord.query.filter(PersonalRecord.group_id == group_id).count()
+
+                    def progress(rows: int):
+                        write_status(job_id, group_id, 'running', min(99, rows * 100 // max(total, 1)))
+                        # 使用 gevent worker 时让出 CPU，生成报告期间其他请求仍能被处理
+                        time.sleep(0)
+
+                    get_report(group_id, data_version, options, progress=progress)
+                    write_status(job_id, group_id, 'done', 100)
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            logger.error('Failed to generate report %s: %s', job_id, e)
+            write_status(job_id, group_id, 'failed', 0, error=str(e))
+        finally:
+            with self._lock:
+                self._active -= 1
+
+
+report_jobs = ReportJobs(workers=getattr(Config, 'REPORT_JOB_WORKERS', 2),
+                         max_jobs=getattr(Config, 'REPORT_JOB_LIMIT', 16),
+                         timeout=getattr(Config, 'REPORT_JOB_TIMEOUT', 600))
@@ -2,8 +2,10 @@ from flask import request, jsonify, g
 from typing import List
 from server_app.auth_tools import login_required
 from data.model import *
-from server_app.group_tools import get_group_of_user
+from server_app.group_tools import get_group_of_user, bump_data_version, group_etag
 from data.alchemy_encoder import AlchemyEncoder
+from server_app.push_notification_tools import join_group_tag_later, leave_group_tag_later
+from server_app.record.nickname_tools import invalidate_nickname_index
 from . import group_blueprint
 
 
@@ -71,7 +73,10 @@ def create_group():
     db.session.refresh(new_group)
     user.group_id = new_group.id
     user.role = 2  # 玩家成爲會長
+    bump_data_version(new_group.id)
     db.session.commit()
+    invalidate_nickname_index(new_group.id)
+    join_group_tag_later(new_group.id, [user.username])
 
     return jsonify({
         "msg": "Successful!",
@@ -81,6 +86,7 @@ def create_group():
 
 @group_blueprint.route('/get_members', methods=['GET'])
 @login_required
+@group_etag()
 def get_members():
     """
     @api {get} /v1/group/get_members 获取公会成员信息
@@ -90,6 +96,7 @@ def get_members():
 
     @apiSuccess (回参) {String}                 msg     为"Successful!"
     @apiSuccess (回参) {List[Dictionary]}       data    公会成员列表，包含Users表中的id, group_id, nickname, role, username.
+    @apiHeader {String} If-None-Match  (可选)    上一次返回的 ETag，成员没有变化时返回 304
 
         @apiSuccessExample {json} 成功样例
         HTTP/1.1 200 OK
@@ -199,7 +206,10 @@ def kick_member():
         return jsonify({"msg": "Invalid ID"}), 204
     user_to_be_kicked.group_id = None
     user_to_be_kicked.role = 0
+    bump_data_version(group.id)
     db.session.commit()
+    invalidate_nickname_index(group.id)
+    leave_group_tag_later(group.id, [user_to_be_kicked.username])
 
     return jsonify({
         "msg": "Successful!"
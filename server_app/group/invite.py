@@ -3,6 +3,9 @@ from typing import List
 from server_app.auth_tools import login_required
 from data.model import *
 from data.alchemy_encoder import AlchemyEncoder
+from server_app.group_tools import bump_data_version
+from server_app.push_notification_tools import leave_group_tag_later
+from server_app.record.nickname_tools import invalidate_nickname_index
 from . import group_blueprint
 
 
@@ -68,7 +71,10 @@ def invite_member():
     if not user_to_be_kicked:
         return jsonify({"msg": "Invalid ID", "code": 405}), 204
     user_to_be_kicked.group_id = -1
+    bump_data_version(group.id)
     db.session.commit()
+    invalidate_nickname_index(group.id)
+    leave_group_tag_later(group.id, [user_to_be_kicked.username])
 
     return jsonify({
         "msg": "Successful!"
@@ -1,7 +1,9 @@
 from .auth_tools import login_required
-from flask import g, jsonify
+from flask import g, jsonify, request, make_response
 from data.model import *
-from typing import Optional
+from typing import Optional, Callable
+from functools import wraps
+from sqlalchemy import event
 
 
 @login_required
@@ -13,3 +15,56 @@ def get_group_of_user() -> Optional[Group]:
     user: User = g.user
     group: Group = Group.query.filter_by(id=user.group_id).first()
     return group
+
+
+def bump_data_version(group_id: Optional[int]):
+    """
+    公会的出刀记录、Boss 状态或成员发生变化时，在同一个事务中调用，每个事务只加一次。
+    UPDATE 同时锁住公会这一行，直到事务提交，同一个公会的写入因此按顺序得到不同的版本。
+    """
+    if not group_id or group_id <= 0:
+        return
+    bumped: set = db.session.info.setdefault('bumped_groups', set())
+    if group_id in bumped:
+        return
+    Group.query.filter(Group.id == group_id) \
+        .update({Group.data_version: Group.data_version + 1}, synchronize_session=False)
+    bumped.add(group_id)
+
+
+def data_version_of(group_id: int) -> int:
+    return Group.query.with_entities(Group.data_version).filter(Group.id == group_id).scalar()
+
+
+@event.listens_for(db.session, 'after_commit')
+@event.listens_for(db.session, 'after_rollback')
+def _reset_bumped_groups(session):
+    session.info.pop('bumped_groups', None)
+
+
+def group_etag(skip: Optional[Callable[[], bool]] = None):
+    """
+    用公会的 data_version 作为读取接口的 ETag，必须放在 login_required 之后。
+    请求的 If-None-Match 与当前版本相同时直接返回 304，不执行接口本身的查询。
+    :param skip: 返回 True 时不使用 ETag（数据不只由本服务修改的情况）
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            user: User = g.user
+            group: Optional[Group] = user.group if user.group_id else None
+            if group is None or (skip is not None and skip()):
+                return f(*args, **kwargs)
+            etag = str(group.id) + '-' + str(group.data_version)
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            return response
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,77 @@
+from config import Config
+from requests.adapters import HTTPAdapter
+from collections import defaultdict
+import requests
+import threading
+import time
+
+
+class HttpClient:
+    """
+    对某个外部服务（TPNS、QQ Bot 等）复用的 HTTP 客户端。
+    使用 keep-alive 连接池，避免每条消息都重新进行 TCP/TLS 握手，并统一设置连接和读取超时。
+    """
+
+    def __init__(self, name: str, pool_size: int, connect_timeout: float, read_timeout: float):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.monotonic()
+        try:
+            response = self.session.post(url, **kwargs)
+        except requests.RequestException:
+            self._count('errors')
+            raise
+        finally:
+            latency = time.monotonic() - start
+            with self._lock:
+                self._counters['requests'] += 1
+                self._counters['total_latency'] += latency
+                self._counters['max_latency'] = max(self._counters['max_latency'], latency)
+        if response.status_code >= 400:
+            self._count('errors')
+        return response
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            requests_ = int(self._counters['requests'])
+            return {
+                "requests": requests_,
+                "errors": int(self._counters['errors']),
+                "avg_latency": round(self._counters['total_latency'] / requests_, 3) if requests_ else 0,
+                "max_latency": round(self._counters['max_latency'], 3)
+            }
+
+
+_clients = dict()
+_clients_lock = threading.Lock()
+
+
+def get_client(name: str) -> HttpClient:
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = HttpClient(name,
+                                    pool_size=getattr(Config, 'HTTP_POOL_SIZE', 10),
+                                    connect_timeout=getattr(Config, 'HTTP_CONNECT_TIMEOUT', 3.05),
+                                    read_timeout=getattr(Config, 'HTTP_READ_TIMEOUT', 10))
+                _clients[name] = client
+    return client
+
+
+def http_metrics() -> dict:
+    return {name: client.metrics() for name, client in _clients.items()}
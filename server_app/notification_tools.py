@@ -0,0 +1,106 @@
+from config import Config
+from data.model import TeamRecord
+from .push_notification_tools import push_group_later
+from .qq_tools import send_message_to_qq_later
+from .dispatch_tools import dispatcher
+from typing import Optional
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def boss_status(team_record: TeamRecord) -> str:
+    return str(team_record.current_boss_order) + '王血量还剩' + str(team_record.boss_remaining_health) + \
+        '，当前为' + str(team_record.current_boss_gen) + '周目。'
+
+
+class NotificationCoalescer:
+    """
+    合并同一个公会在短时间内的出刀通知。
+    第一条通知到达后等待 window 秒，期间的通知合并成一条推送和一条 QQ 群消息发出。
+    只有一条通知时按原样发送。
+    dispatcher 开启 persistent 时，等待中的通知在请求中就写入 outbox，
+    进程在合并发送之前退出的话，租约过期后会被单独发送，不会丢失。
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._app = None
+        self._pending = dict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+
+    def add(self, group_id: int, content: str, status: str,
+            qq_message: Optional[str] = None, qq_chat_id=None, qq_header: Optional[dict] = None, count: int = 1):
+        """
+        :param content: 这条通知单独发送时的推送内容
+        :param status: 这条通知之后的 boss 状态，合并发送时使用最后一条的状态
+        :param qq_message: 这条通知单独发送时的 QQ 群消息，为 None 时不发送 QQ 消息
+        :param count: 这条通知包含的出刀记录数
+        """
+        event = dict(group_id=group_id, content=content, status=status, count=count,
+                     qq_message=qq_message, qq_chat_id=qq_chat_id, qq_header=qq_header)
+        if self.window <= 0:
+            self._send([event])
+            return
+        event['outbox_id'] = dispatcher.hold('notification', **event)
+        with self._lock:
+            events = self._pending.get(group_id)
+            if events is not None:
+                events.append(event)
+                return
+            self._pending[group_id] = [event]
+        timer = threading.Timer(self.window, self._flush, args=(group_id,))
+        timer.daemon = True
+        timer.start()
+
+    def _flush(self, group_id: int):
+        with self._lock:
+            events = self._pending.pop(group_id, [])
+        if not events:
+            return
+        # 在计时器线程中执行，开启 persistent 时入队需要访问数据库
+        with self._app.app_context():
+            try:
+                self._send(events)
+            except Exception as e:
+                # outbox 中的通知仍然保留，租约过期后会被单独发送
+                logger.error('Failed to send notifications of group %s: %s', group_id, e)
+                return
+            dispatcher.release([event['outbox_id'] for event in events])
+
+    def _send(self, events: list):
+        latest = events[-1]
+        if len(events) == 1:
+            push_content = latest['content']
+        else:
+            push_content = str(sum(event['count'] for event in events)) + '条新纪录。' + latest['status']
+        push_group_later(latest['group_id'], '添加了新纪录', '', push_content)
+
+        qq_events = [event for event in events if event['qq_message']]
+        if not qq_events:
+            return
+        latest = qq_events[-1]
+        if len(qq_events) == 1:
+            qq_message = latest['qq_message']
+        else:
+            qq_message = '添加了' + str(sum(event['count'] for event in qq_events)) + '条新的记录喵！'
+            for event in qq_events:
+                qq_message += '\n' + event['content']
+            qq_message += '\n' + latest['status']
+        send_message_to_qq_later(message=qq_message, id_=latest['qq_chat_id'], type_='group',
+                                 header=latest['qq_header'])
+
+
+notification_coalescer = NotificationCoalescer(window=getattr(Config, 'NOTIFICATION_WINDOW', 2))
+
+
+def _send_held_notification(**event):
+    # 进程退出前没有合并发送的通知，由 outbox 清扫线程重新领取后单独发送
+    notification_coalescer._send([event])
+
+
+dispatcher.register('notification', _send_held_notification, concurrency=1)
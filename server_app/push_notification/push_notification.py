@@ -4,6 +4,8 @@ from data.model import *
 from . import pn_blueprint
 
 from server_app.push_notification_tools import account_with_token
+from server_app.dispatch_tools import dispatcher
+from server_app.http_tools import http_metrics
 
 
 @pn_blueprint.route('/link_token', methods=['POST'])
@@ -66,3 +68,24 @@ def unlink_token():
 
     result = account_with_token(account=user.username, platform=platform, token=token, operator_type=3)
     return result, 200
+
+
+@pn_blueprint.route('/dispatcher_status', methods=['GET'])
+@login_required
+def dispatcher_status():
+    """
+    @api {get} /v1/push/dispatcher_status 获取后台推送队列状态
+    @apiVersion 1.0.0
+    @apiName dispatcher_status
+    @apiGroup Push Notification
+    @apiDescription 返回当前 worker 的后台发送队列长度，各目的地的发送数、重试数、失败数和排队延迟（秒），
+    以及各外部服务的 HTTP 请求数、错误数和延迟（秒）。
+
+    @apiSuccess (回参) {String}     msg        为"Successful!"
+    @apiSuccess (回参) {Dictionary} data       队列状态
+
+    """
+    return jsonify({
+        "msg": "Successful!",
+        "data": dict(dispatcher.metrics(), http=http_metrics())
+    }), 200
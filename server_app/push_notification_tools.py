@@ -3,7 +3,9 @@ import hmac
 import base64
 from datetime import datetime
 from hashlib import sha256
-import requests
+from .dispatch_tools import dispatcher
+from .http_tools import get_client
+from functools import lru_cache
 
 
 def generate_cert(json: dict):
@@ -14,12 +16,18 @@ def generate_cert(json: dict):
     return base64.b64encode(key.encode())
 
 
+@lru_cache(maxsize=1)
+def _authorization() -> str:
+    # 认证信息只与配置有关，只计算一次
+    return 'Basic ' + generate_cert(dict()).decode()
+
+
 def generate_header(json: dict) -> dict:
     # timestamp = str(int(datetime.timestamp(datetime.now())))
     # header = {'Sign': generate_cert(time_stamp=timestamp, json=json),
     #           'TimeStamp': timestamp,
     #           'AccessId': str(Config.TPN_ACCESS_ID)}
-    header = {'Authorization': 'Basic ' + generate_cert(json).decode()}
+    header = {'Authorization': _authorization()}
     return header
 
 
@@ -37,10 +45,26 @@ def account_with_token(platform: str, account: str, token: str, operator_type: i
             ]
         }]}
     print(data)
-    r = requests.post(base_url, json=data, headers=generate_header(data))
+    r = get_client('tpns').post(base_url, json=data, headers=generate_header(data))
     return r.json()
 
 
+def _ios_message(title: str, subtitle: str, content: str) -> dict:
+    return {
+        "title": title,
+        "content": content,
+        "ios": {
+            "aps": {
+                "alert": {
+                    "subtitle": subtitle
+                },
+                "badge_type": -2
+
+            }
+        }
+    }
+
+
 def push_ios(account_list: list, title: str, subtitle: str, content: str):
     environment = 'dev'
     base_url = 'https://api.tpns.tencent.com/v3/push/app'
@@ -49,25 +73,97 @@ def push_ios(account_list: list, title: str, subtitle: str, content: str):
         "environment": environment,
         "account_list": account_list,
         "message_type": "notify",
-        "message": {
-            "title": title,
-            "content": content,
-            "ios": {
-                "aps": {
-                    "alert": {
-                        "subtitle": subtitle
-                    },
-                    "badge_type": -2
+        "message": _ios_message(title, subtitle, content)
+    }
+    r = get_client('tpns').post(base_url, json=data, headers=generate_header(data))
+    return r.json()
 
-                }
-            }
-        }
+
+def group_tag(group_id: int) -> str:
+    # 每个公会的成员都绑定这个标签，推送时只需要指定标签
+    return 'group-' + str(group_id)
+
+
+def push_ios_to_tag(tag: str, title: str, subtitle: str, content: str):
+    environment = 'dev'
+    base_url = 'https://api.tpns.tencent.com/v3/push/app'
+    data = {
+        "audience_type": "tag",
+        "environment": environment,
+        "tag_rules": [{
+            "tag_items": [{
+                "tags": [tag],
+                "is_not": False,
+                "tags_operator": "OR",
+                "items_operator": "OR",
+                "tag_type": "xg_user_define"
+            }],
+            "operator": "OR",
+            "is_not": False
+        }],
+        "message_type": "notify",
+        "message": _ios_message(title, subtitle, content)
     }
-    print("-------------------------")
-    print(data)
-    r = requests.post(base_url, json=data, headers=generate_header(data))
+    r = get_client('tpns').post(base_url, json=data, headers=generate_header(data))
     return r.json()
 
 
+# 标签接口的 operator_type：为账号批量绑定/解绑标签
+TAG_BIND_ACCOUNTS = 9
+TAG_UNBIND_ACCOUNTS = 10
+# 每次请求最多操作的账号数
+TAG_BATCH_SIZE = 500
+
+
+def tag_accounts(tag: str, accounts: list, operator_type: int):
+    base_url = 'https://api.tpns.tencent.com/v3/device/tag'
+    result = dict()
+    for start in range(0, len(accounts), TAG_BATCH_SIZE):
+        data = {
+            "operator_type": operator_type,
+            "tag_list": [tag],
+            "account_list": accounts[start:start + TAG_BATCH_SIZE]
+        }
+        r = get_client('tpns').post(base_url, json=data, headers=generate_header(data))
+        result = r.json()
+        if result.get('ret_code', 0) != 0:
+            break
+    return result
+
+
+TPNS_METHODS = {
+    'push_ios': push_ios,
+    'push_ios_to_tag': push_ios_to_tag,
+    'tag_accounts': tag_accounts
+}
+
+
+def _tpns_job(method: str, **kwargs):
+    result = TPNS_METHODS[method](**kwargs)
+    if result.get('ret_code', 0) != 0:
+        raise RuntimeError(result.get('err_msg', 'TPNS returned ' + str(result.get('ret_code'))))
+
+
+dispatcher.register('tpns', _tpns_job, concurrency=getattr(Config, 'TPNS_CONCURRENCY', 4))
+
+
+def push_group_later(group_id: int, title: str, subtitle: str, content: str):
+    # 在后台推送给公会所有成员，不阻塞当前请求
+    dispatcher.enqueue('tpns', method='push_ios_to_tag', tag=group_tag(group_id),
+                       title=title, subtitle=subtitle, content=content)
+
+
+def join_group_tag_later(group_id: int, accounts: list):
+    if accounts:
+        dispatcher.enqueue('tpns', method='tag_accounts', tag=group_tag(group_id),
+                           accounts=accounts, operator_type=TAG_BIND_ACCOUNTS)
+
+
+def leave_group_tag_later(group_id: int, accounts: list):
+    if accounts:
+        dispatcher.enqueue('tpns', method='tag_accounts', tag=group_tag(group_id),
+                           accounts=accounts, operator_type=TAG_UNBIND_ACCOUNTS)
+
+
 if __name__ == '__main__':
     print(generate_cert(str(int(datetime.timestamp(datetime.now()))), dict()))
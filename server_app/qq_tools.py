@@ -1,11 +1,21 @@
-import requests
 from config import Config
+from .dispatch_tools import dispatcher
+from .http_tools import get_client
 
 
 def send_message_to_qq(message: str, id_: int, type_: str, header: dict):
     url = Config.QQ_BOT_URL + '/send_message'
     json = dict(message=message, id=id_, type=type_)
     print(json)
-    r = requests.post(url=url, json=json, headers=header)
+    r = get_client('qq').post(url, json=json, headers=header)
     print(r.content)
     print(r.text)
+    r.raise_for_status()
+
+
+dispatcher.register('qq', send_message_to_qq, concurrency=getattr(Config, 'QQ_BOT_CONCURRENCY', 2))
+
+
+def send_message_to_qq_later(message: str, id_: int, type_: str, header: dict):
+    # 在后台发送，不阻塞当前请求
+    dispatcher.enqueue('qq', message=message, id_=id_, type_=type_, header=header)
@@ -8,5 +8,9 @@ record_blueprint = Blueprint(
 
 from .record import *
 from .add_record_if_needed import *
+from .add_records_bulk import *
 from .delete_record import *
 from .get_records import *
+from .changes import *
+from .stream import *
+from .stats import *
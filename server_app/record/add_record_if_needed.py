@@ -2,12 +2,16 @@ from flask import request, jsonify, g
 import datetime
 from ..auth_tools import login_required
 from data.model import *
-from .record_tools import damage_to_score, subtract_damage_from_group
+from .record_tools import damage_to_score, subtract_damage_from_group, make_new_team_record, get_team_record, \
+    read_team_record
+from .nickname_tools import match_nickname
+from .duplicate_tools import is_recent_duplicate, remember_damage
+from .summary_tools import add_to_summary
+from .epoch_tools import current_epoch_id
 from . import record_blueprint
 from config import Config
-from server_app.push_notification_tools import push_ios
-from datetime import timedelta
-from server_app.qq_tools import send_message_to_qq
+from server_app.notification_tools import notification_coalescer, boss_status
+from server_app.group_tools import bump_data_version
 
 
 @record_blueprint.route('/add_record_if_needed', methods=['POST'])
@@ -31,6 +35,10 @@ def add_record_if_needed():
         HTTP/1.1 403 Forbidden
         {"msg": "User is not in any group."}
 
+    @apiErrorExample {json} 还没有开始的会战
+        HTTP/1.1 412 Precondition Failed
+        {"msg": "Team battle has not started."}
+
     """
     user: User = g.user
 
@@ -47,103 +55,61 @@ def add_record_if_needed():
     group: Group = user.group
     if not group:
         return jsonify({"msg": "User's group not found."}), 417
-    team_record: TeamRecord = group.team_record \
-        .order_by(TeamRecord.last_modified.desc()).first()
+    epoch_id = current_epoch_id()
+    if epoch_id is None:
+        return jsonify({"msg": "Team battle has not started."}), 412
+    team_record: TeamRecord = get_team_record(group_id=group.id, data_version=group.data_version)
     if not team_record:
-        current_epoch: TeamBattleEpoch = TeamBattleEpoch.query \
-            .order_by(TeamBattleEpoch.end_date.desc()).limit(1).first()
-        team_record = TeamRecord(detail_date=datetime.datetime.now(),
-                                 epoch_id=current_epoch.id,
-                                 group_id=group.id,
-                                 current_boss_gen=1,
-                                 current_boss_order=1,
-                                 boss_remaining_health=Config.BOSS_HEALTH[0],
-                                 last_modified=datetime.datetime.now())
-        db.session.add(team_record)
-        db.session.commit()
-        db.session.refresh(team_record)
-    else:
-        team_record.last_modified = datetime.datetime.now()
+        team_record = make_new_team_record(group_id=group.id)
 
-    closest_name = get_closest_player_name(nickname, group_id=group.id)
-    user_of_attack = User.query.filter_by(nickname=closest_name, group_id=group.id).first()
+    user_of_attack = match_nickname(nickname, group_id=group.id)
     if not user_of_attack:
         return jsonify({"msg": "Group doesn't have a user with this name."}), 412
-    start = datetime.datetime.now() - timedelta(days=1)
-    existing_record = PersonalRecord.query.filter_by(real_damage=damage, group_id=group.id)\
-        .filter(PersonalRecord.detail_date > start).first()
-    if existing_record:
+    if is_recent_duplicate(group.id, damage, user_of_attack.nickname, group.data_version):
         return jsonify({"msg": "Already Recorded. "}), 200
-    else:
-        existing_record = PersonalRecord.query\
-            .filter(PersonalRecord.real_damage.is_(None),
-                    PersonalRecord.damage == damage,
-                    PersonalRecord.group_id == group.id,
-                    PersonalRecord.detail_date > start).first()
-        if existing_record:
-            return jsonify({"msg": "Already Recorded. "}), 200
 
     real_damage = damage
-    if team_record.boss_remaining_health <= damage:
-        type_ = 'last'
-        damage = team_record.boss_remaining_health
-    else:
-        type_ = 'normal'  # OCR没有办法判断补偿刀
-
     added_record: PersonalRecord = PersonalRecord(group_id=user.group_id,
-                                                  boss_gen=team_record.current_boss_gen,
-                                                  boss_order=team_record.current_boss_order,
-                                                  damage=damage,
                                                   real_damage=real_damage,
-                                                  user_id=user_of_attack.id,
+                                                  user_id=user_of_attack.user_id,
                                                   nickname=user_of_attack.nickname,
                                                   detail_date=datetime.datetime.now(),
-                                                  type=type_,
                                                   last_modified=datetime.datetime.now(),
-                                                  epoch_id=team_record.epoch_id)
-    added_record.score = damage_to_score(record=added_record)
-    subtract_damage_from_group(record=added_record, team_record=team_record)
+                                                  epoch_id=epoch_id)
+
+    def assign_target(current: TeamRecord):
+        # OCR 的出刀总是记在扣血时的 boss 上，超过剩余血量的伤害算作尾刀
+        added_record.boss_gen = current.current_boss_gen
+        added_record.boss_order = current.current_boss_order
+        if current.boss_remaining_health <= real_damage:
+            added_record.type = 'last'
+            added_record.damage = current.boss_remaining_health
+        else:
+            added_record.type = 'normal'  # OCR没有办法判断补偿刀
+            added_record.damage = real_damage
+        added_record.score = damage_to_score(record=added_record)
+
+    subtract_damage_from_group(record=added_record, team_record=team_record, assign_target=assign_target)
     db.session.add(added_record)
+    bump_data_version(group.id)
+    add_to_summary(added_record)
 
     db.session.commit()
+    remember_damage(group.id, real_damage, added_record.nickname, added_record.detail_date, group.data_version)
+    team_record = read_team_record(group_id=group.id)
 
-    user_name_list = []
-    for user_obj in group.users:
-        user_name_list.append(user_obj.username)
     damage_msg = user_of_attack.nickname
-    damage_msg += '对' + str(team_record.current_boss_order) + '王'
+    damage_msg += '对' + str(added_record.boss_order) + '王'
     damage_msg += '造成了' + str(added_record.damage) + '点伤害'
     if team_record.boss_remaining_health == Config.BOSS_HEALTH[team_record.current_boss_order - 1]:
         damage_msg += '并击破。'
     else:
         damage_msg += '。Boss 血量还剩' + str(team_record.boss_remaining_health) + '。'
-    push_ios(user_name_list, '添加了新纪录', '', damage_msg)
 
     headers = dict(auth=request.headers.get('auth'))
-    damage_msg = '通过OCR添加了新的记录喵！\n' + damage_msg
-    send_message_to_qq(message=damage_msg, id_=group.group_chat_id, type_='group', header=headers)
+    notification_coalescer.add(group.id, damage_msg, boss_status(team_record),
+                               qq_message='通过OCR添加了新的记录喵！\n' + damage_msg,
+                               qq_chat_id=group.group_chat_id, qq_header=headers)
 
     return jsonify({"msg": "Successful!"}), 200
 
-
-def get_closest_player_name(name: str, group_id: int):
-    players = User.query.filter_by(group_id=group_id).all()
-    all_players_list = list()
-    player: User
-    for player in players:
-        all_players_list.append([player.nickname, 0])
-
-    for element in all_players_list:
-        for letter in name:
-            if letter in element[0]:
-                element[1] += 1
-
-    all_players_list.sort(key=sort_by_relevance, reverse=True)
-    if all_players_list[0][1] == 0:
-        return '不知道是谁'
-    else:
-        return all_players_list[0][0]
-
-
-def sort_by_relevance(element):
-    return element[1]
@@ -0,0 +1,201 @@
+from flask import request, jsonify, g
+import datetime
+from ..auth_tools import login_required
+from data.model import *
+from .record_tools import damage_to_score, subtract_damages_from_group, make_new_team_record, \
+    get_team_record, read_team_record
+from .duplicate_tools import remember_damage
+from .summary_tools import add_records_to_summary
+from .epoch_tools import current_epoch_id
+from data.alchemy_encoder import AlchemyEncoder
+import json as js
+from . import record_blueprint
+from config import Config
+from server_app.notification_tools import notification_coalescer, boss_status
+from server_app.group_tools import bump_data_version
+from server_app.change_log_tools import log_change
+from sqlalchemy import func
+
+RECORD_TYPES = ('normal', 'last', 'compensation')
+# 需要转换为整数的字段，没有提供时不检查
+INTEGER_FIELDS = ('damage', 'user_id', 'boss_gen', 'boss_order', 'detail_date')
+
+
+def is_integer(value) -> bool:
+    # 接受整数或者只包含数字的字符串，与 int() 的转换结果一致
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, int) and value >= 0 or isinstance(value, str) and value.isdigit()
+
+
+def is_valid_record(record) -> bool:
+    if not isinstance(record, dict):
+        return False
+    for field in INTEGER_FIELDS:
+        if record.get(field, None) and not is_integer(record[field]):
+            return False
+    boss_order = record.get('boss_order', None)
+    if boss_order and not 1 <= int(boss_order) <= 5:
+        return False
+    detail_date = record.get('detail_date', None)
+    if detail_date:
+        try:
+            datetime.datetime.fromtimestamp(int(detail_date))
+        except (OverflowError, OSError, ValueError):
+            return False
+    return True
+
+
+@record_blueprint.route('/add_records_bulk', methods=['POST'])
+@login_required
+def add_records_bulk():
+    """
+    @api {post} /v1/record/add_records_bulk 批量出刀
+    @apiVersion 1.0.0
+    @apiName add_records_bulk
+    @apiGroup Records
+    @apiParam {List[Dictionary]}  records    (必须)    按出刀顺序排列的出刀列表，每一项的参数同add_record
+    @apiParam {String}  records.damage       (必须)    伤害（尾刀可不提供）
+    @apiParam {String}  records.type         (必须)    出刀类型(normal:普通刀/last:尾刀/compensation:补偿刀)
+    @apiParam {String}  records.user_id      (可选)    出刀用户ID，如果不提供则默认为当前用户自己出刀
+    @apiParam {String}  records.boss_gen     (可选)    boss周目（如果没有则为这一刀时的boss）
+    @apiParam {String}  records.boss_order   (可选)    第几个boss（如果没有则为这一刀时的boss）
+    @apiParam {int}     records.detail_date  (可选)    出刀时间戳（秒），不提供则为当前时间
+    @apiParam {String}  origin               (可选)    请求来源。例如「iOS 客户端」「Web 端」等
+    @apiDescription 在一次请求中按顺序补录多条出刀，所有记录在同一个事务中写入，只发送一次通知。
+
+    @apiSuccess (回参) {String}     msg          为"Successful!"
+    @apiSuccess (回参) {int}        count        添加的记录数
+    @apiSuccess (回参) {Dictionary} team_record  更新后的当前公会信息，具体内容参照TeamRecord表
+
+    @apiErrorExample {json} 参数不存在
+        HTTP/1.1 400 Bad Request
+        {"msg": "Parameter is missing"}
+
+    @apiErrorExample {json} 出刀中的数值不是整数（damage/user_id/boss_gen/boss_order/detail_date）
+        HTTP/1.1 400 Bad Request
+        {"msg": "Illegal record parameter.", "code": 301}
+
+    @apiErrorExample {json} 用户没有加入公会
+        HTTP/1.1 403 Forbidden
+        {"msg": "User is not in any group."}
+
+    @apiErrorExample {json} 记录过多
+        HTTP/1.1 413 Payload Too Large
+        {"msg": "Too many records."}
+
+    @apiErrorExample {json} 用户的公会不存在
+        HTTP/1.1 417 Expectation Failed
+        {"msg": "User's group not found."}
+
+    @apiErrorExample {json} 用户的公会没有相应用户
+        HTTP/1.1 412 Precondition Failed
+        {"msg": "Group doesn't have a user with this ID."}
+
+    @apiErrorExample {json} 还没有开始的会战
+        HTTP/1.1 412 Precondition Failed
+        {"msg": "Team battle has not started."}
+
+    """
+    user: User = g.user
+
+    json = request.get_json(force=True)
+    records = json.get('records', None)
+    origin = json.get('origin', None)
+
+    if not records or not isinstance(records, list):
+        return jsonify({"msg": "Parameter is missing"}), 400
+    if len(records) > getattr(Config, 'BULK_RECORD_LIMIT', 500):
+        return jsonify({"msg": "Too many records."}), 413
+    for record in records:
+        if not is_valid_record(record):
+            return jsonify({"msg": "Illegal record parameter.", "code": 301}), 400
+        if record.get('type', None) not in RECORD_TYPES:
+            return jsonify({"msg": "Parameter is missing"}), 400
+        if record['type'] != 'last' and not record.get('damage', None):
+            return jsonify({"msg": "Parameter is missing"}), 400
+    if user.group_id is None:
+        return jsonify({"msg": "User is not in any group."}), 403
+
+    group: Group = user.group
+    if not group:
+        return jsonify({"msg": "User's group not found."}), 417
+
+    # 一次查询出所有出刀用户
+    user_ids = {int(record['user_id']) for record in records if record.get('user_id', None)}
+    users = {user.id: user}
+    if user_ids:
+        for member in User.query.filter(User.group_id == group.id, User.id.in_(user_ids)):
+            users[member.id] = member
+        if not user_ids.issubset(users):
+            return jsonify({"msg": "Group doesn't have a user with this ID."}), 412
+
+    epoch_id = current_epoch_id()
+    if epoch_id is None:
+        return jsonify({"msg": "Team battle has not started."}), 412
+    team_record: TeamRecord = get_team_record(group_id=group.id, data_version=group.data_version)
+    if not team_record:
+        team_record = make_new_team_record(group_id=group.id)
+
+    attacks = subtract_damages_from_group(attacks=records, team_record=team_record)
+
+    now = datetime.datetime.now()
+    added_records = list()
+    for attack in attacks:
+        user_of_attack = users[int(attack['user_id'])] if attack.get('user_id', None) else user
+        detail_date = attack.get('detail_date', None)
+        detail_date = datetime.datetime.fromtimestamp(int(detail_date)) if detail_date else now
+        added_record = PersonalRecord(group_id=group.id,
+                                      boss_gen=attack['boss_gen'],
+                                      boss_order=attack['boss_order'],
+                                      damage=attack['damage'],
+                                      user_id=user_of_attack.id,
+                                      nickname=user_of_attack.nickname,
+                                      detail_date=detail_date,
+                                      type=attack['type'],
+                                      last_modified=now,
+                                      epoch_id=epoch_id)
+        added_record.score = damage_to_score(record=added_record)
+        added_records.append(added_record)
+    # 先锁住公会，这个公会在插入前后新增的记录就只有这一批
+    bump_data_version(group.id)
+    last_id = db.session.query(func.max(PersonalRecord.id)).filter(PersonalRecord.group_id == group.id).scalar()
+    db.session.bulk_save_objects(added_records)
+    # bulk_save_objects 不返回 ID，也不经过 Session，需要手动记录修改
+    added_ids = db.session.query(PersonalRecord.id) \
+        .filter(PersonalRecord.group_id == group.id, PersonalRecord.id > (last_id or 0))
+    for (added_id,) in added_ids:
+        log_change(group.id, 'personal_record', added_id, 'insert')
+    add_records_to_summary(added_records)
+
+    db.session.commit()
+    data_version = group.data_version
+    for added_record in added_records:
+        remember_damage(group.id, added_record.damage, added_record.nickname, added_record.detail_date,
+                        data_version)
+    team_record = read_team_record(group_id=group.id)
+
+    content = '补录了' + str(len(added_records)) + '条记录，共造成'
+    content += str(sum(record.damage for record in added_records)) + '点伤害。'
+    content += str(team_record.current_boss_order) + \
+        '王血量还剩' + str(team_record.boss_remaining_health) + '。'
+
+    origin = origin if origin else '客户端'
+    msg = '通过' + origin + '添加了新的记录喵！'
+    msg += '\n' + content
+    msg += '\n' + '当前为' + str(team_record.current_boss_gen) + '周目'
+
+    if origin == "QQ":
+        notification_coalescer.add(group.id, content, boss_status(team_record), count=len(added_records))
+        return_data = dict(message=msg, id=group.group_chat_id, type='group')
+        return jsonify(return_data), 200
+    else:
+        headers = dict(auth=request.headers.get('auth'))
+        notification_coalescer.add(group.id, content, boss_status(team_record),
+                                   qq_message=msg, qq_chat_id=group.group_chat_id, qq_header=headers,
+                                   count=len(added_records))
+        return js.dumps({
+            "msg": "Successful!",
+            "count": len(added_records),
+            "team_record": team_record
+        }, cls=AlchemyEncoder), 200
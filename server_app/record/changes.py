@@ -0,0 +1,126 @@
+from flask import request, jsonify, g
+from ..auth_tools import login_required
+from data.model import *
+from data.alchemy_encoder import AlchemyEncoder
+import json as js
+from . import record_blueprint
+from config import Config
+
+# change_log 中的表名对应的 model
+CHANGE_LOG_MODELS = {
+    'personal_record': PersonalRecord,
+    'team_record': TeamRecord,
+    'team_rank': TeamRank
+}
+
+
+@record_blueprint.route('/changes', methods=['GET'])
+@login_required
+def get_changes():
+    """
+    @api {get} /v1/record/changes 增量同步
+    @apiVersion 1.0.0
+    @apiName get_changes
+    @apiGroup Records
+    @apiParam {int}     since             (必要)    上一次同步返回的 seq，第一次同步时为 0
+    @apiParam {int}     limit             (可选)    最多返回多少条修改，默认为 CHANGES_LIMIT
+    @apiDescription 返回 seq 之后公会出刀记录、Boss 状态和排名的修改。
+    同一行的多次修改只返回最后一次，data 为这一行现在的内容，operation 为 delete 时 data 为 null。
+
+    @apiSuccess (回参) {String}           msg       为"Successful!"
+    @apiSuccess (回参) {int}              seq       下一次同步时作为 since 提交
+    @apiSuccess (回参) {Boolean}          has_more  为 true 时还有更多修改，需要立即用 seq 再请求一次
+    @apiSuccess (回参) {List[Dictionary]} changes   修改列表，包含 seq, table, operation, id, data
+
+    @apiSuccessExample {json} 成功样例
+        HTTP/1.1 200 OK
+        {
+            "msg": "Successful!",
+            "seq": 42,
+            "has_more": false,
+            "changes": [
+                {"seq": 41, "table": "personal_record", "operation": "insert", "id": 1234, "data": {...}},
+                {"seq": 42, "table": "personal_record", "operation": "delete", "id": 1200, "data": null}
+            ]
+        }
+
+    @apiErrorExample {json} 没有提供正确的since
+        HTTP/1.1 400 Bad Request
+        {"msg": "Illegal since parameter."}
+
+    @apiErrorExample {json} 用户没有加入公会
+        HTTP/1.1 403 Forbidden
+        {"msg": "User is not in any group."}
+
+    @apiErrorExample {json} 用户的公会不存在
+        HTTP/1.1 417 Expectation Failed
+        {"msg": "User's group not found."}
+
+    """
+    user: User = g.user
+    since: str = request.args.get('since', '')
+    limit: str = request.args.get('limit', '')
+
+    if not since.isdigit():
+        return jsonify({"msg": "Illegal since parameter."}), 400
+    since: int = int(since)
+    default_limit = getattr(Config, 'CHANGES_LIMIT', 1000)
+    limit: int = min(int(limit), default_limit) if limit.isdigit() and int(limit) > 0 else default_limit
+
+    if not user.group_id or user.group_id == -1:
+        return jsonify({"msg": "User is not in any group."}), 403
+    group: Group = user.group
+    if not group:
+        return jsonify({"msg": "User's group not found."}), 417
+
+    version: int = group.data_version
+    if since >= version:
+        # 没有新的修改，不需要查询 change_log
+        return jsonify({"msg": "Successful!", "seq": version, "has_more": False, "changes": []}), 200
+
+    entries = ChangeLog.query.filter(ChangeLog.group_id == group.id, ChangeLog.seq > since) \
+        .order_by(ChangeLog.seq, ChangeLog.id).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    if has_more:
+        # 只返回完整的事务：去掉最后一个可能不完整的 seq
+        last_seq = entries[limit].seq
+        complete = [entry for entry in entries if entry.seq < last_seq]
+        if complete:
+            entries = complete
+        else:
+            entries = ChangeLog.query.filter(ChangeLog.group_id == group.id, ChangeLog.seq == last_seq) \
+                .order_by(ChangeLog.id).all()
+    if has_more:
+        seq = entries[-1].seq
+    else:
+        # 成员变化等不写入 change_log 的修改也会增加版本，直接跳到当前版本
+        seq = max(version, entries[-1].seq) if entries else version
+
+    # 同一行只保留最后一次修改
+    latest = dict()
+    for entry in entries:
+        latest.pop((entry.table_name, entry.row_id), None)
+        latest[(entry.table_name, entry.row_id)] = entry
+
+    rows = dict()
+    for table_name, model in CHANGE_LOG_MODELS.items():
+        ids = [row_id for (name, row_id), entry in latest.items() if name == table_name and entry.operation != 'delete']
+        if ids:
+            for row in model.query.filter(model.id.in_(ids), model.group_id == group.id):
+                rows[(table_name, row.id)] = row
+
+    changes = list()
+    for (table_name, row_id), entry in latest.items():
+        row = rows.get((table_name, row_id))
+        changes.append(dict(seq=entry.seq,
+                            table=table_name,
+                            operation='delete' if row is None else entry.operation,
+                            id=row_id,
+                            data=row))
+
+    return js.dumps({
+        "msg": "Successful!",
+        "seq": seq,
+        "has_more": has_more,
+        "changes": changes
+    }, cls=AlchemyEncoder), 200
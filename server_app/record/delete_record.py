@@ -1,6 +1,10 @@
 from . import record_blueprint
 from server_app.auth_tools import login_required
 from data.model import *
+from .record_tools import invalidate_team_record
+from .duplicate_tools import invalidate_recent_damage
+from .summary_tools import add_to_summary
+from server_app.group_tools import bump_data_version
 from flask import jsonify, request, g
 import datetime
 
@@ -48,12 +52,17 @@ def delete_record():
         return jsonify({"msg": "Already deleted"}), 200
 
     if r.user.id == user.id or user.role > 0:  # 有权限删除
+        add_to_summary(r, sign=-1)
         db.session.delete(r)
         deletion_history = DeletionHistory(deleted_date=datetime.datetime.now(),
                                            from_table='PersonalRecord',
                                            deleted_id=id_,
                                            group_id=user.group_id)
         db.session.add(deletion_history)
+        bump_data_version(user.group_id)
         db.session.commit()
+        invalidate_team_record(group_id=user.group_id)
+        invalidate_recent_damage(group_id=user.group_id)
     else:
         return jsonify({"msg": "Permission Denied"}), 417
+    return jsonify({"msg": "Successful!"}), 200
@@ -0,0 +1,81 @@
+from data.model import PersonalRecord
+from .record_tools import GroupCache
+from datetime import datetime, timedelta
+import threading
+from config import Config
+
+# OCR 重复识别的判断范围
+DUPLICATE_WINDOW = timedelta(days=1)
+
+
+class RecentDamageIndex:
+    """
+    公会最近一段时间内的出刀，按 (伤害, 游戏名) 索引，用于判断 OCR 是否重复提交了同一刀。
+    伤害优先使用 real_damage（尾刀溢出前的伤害）。
+    data_version 为索引包含了哪个版本之前的全部出刀。
+    """
+
+    def __init__(self, rows, data_version: int):
+        self._lock = threading.Lock()
+        self._latest = dict()
+        self.data_version = data_version
+        for damage, real_damage, nickname, detail_date in rows:
+            self.add(real_damage if real_damage is not None else damage, nickname, detail_date)
+
+    def add(self, damage: int, nickname: str, detail_date: datetime):
+        key = (int(damage), nickname)
+        with self._lock:
+            if key not in self._latest or self._latest[key] < detail_date:
+                self._latest[key] = detail_date
+
+    def contains(self, damage: int, nickname: str, now: datetime) -> bool:
+        with self._lock:
+            detail_date = self._latest.get((int(damage), nickname))
+        return detail_date is not None and detail_date > now - DUPLICATE_WINDOW
+
+
+recent_damage_cache = GroupCache(max_size=getattr(Config, 'DUPLICATE_INDEX_CACHE_SIZE', 1024),
+                                 ttl=getattr(Config, 'DUPLICATE_INDEX_CACHE_TTL', 300))
+
+
+def _load_recent_damage(group_id: int, data_version: int, now: datetime) -> RecentDamageIndex:
+    rows = PersonalRecord.query \
+        .with_entities(PersonalRecord.damage, PersonalRecord.real_damage,
+                       PersonalRecord.nickname, PersonalRecord.detail_date) \
+        .filter(PersonalRecord.group_id == group_id,
+                PersonalRecord.detail_date > now - DUPLICATE_WINDOW).all()
+    index = RecentDamageIndex(rows, data_version)
+    recent_damage_cache.set(group_id, index)
+    return index
+
+
+def is_recent_duplicate(group_id: int, damage: int, nickname: str, data_version: int) -> bool:
+    """
+    最近 DUPLICATE_WINDOW 内是否已经有同一成员造成同样伤害的记录。
+    只有还没有索引，或者公会的 data_version 在索引建立后发生了变化（其他 worker 添加或修改了记录）时
+    才从数据库重新加载，否则内存中没有命中就不是重复。
+    :param data_version: 公会当前的 data_version
+    """
+    now = datetime.now()
+    index = recent_damage_cache.get(group_id)
+    if index is None or index.data_version != data_version:
+        index = _load_recent_damage(group_id, data_version, now)
+    return index.contains(damage, nickname, now)
+
+
+def remember_damage(group_id: int, damage: int, nickname: str, detail_date: datetime, data_version: int):
+    """
+    提交出刀后调用，把这次的出刀加入索引。
+    :param data_version: 提交后公会的 data_version。每个事务只加一次版本，
+        索引的版本恰好比它小 1 时，这之间只有这次提交，索引仍然完整，可以继续使用。
+    """
+    index = recent_damage_cache.get(group_id)
+    if index is not None:
+        index.add(damage, nickname, detail_date)
+        if index.data_version == data_version - 1:
+            index.data_version = data_version
+
+
+def invalidate_recent_damage(group_id: int):
+    # 记录被修改或删除后调用
+    recent_damage_cache.invalidate(group_id)
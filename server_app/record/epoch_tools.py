@@ -0,0 +1,88 @@
+from data.model import db, TeamBattleEpoch
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from typing import Optional
+import datetime
+import threading
+import time
+from config import Config
+
+
+class EpochResolver:
+    """
+    缓存当前会战的 epoch_id。
+    当前会战为 from_date <= 现在 <= end_date 的一期；两期之间沿用最近开始的一期；还没有任何一期开始时为 None。
+    结果缓存到会战结束（或下一期开始）为止，本进程修改 team_battle_epoch 后立即失效。
+    其他 worker 修改的会战最多 ttl 秒后读到。
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._epoch_id = None
+        self._valid_until = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def current_epoch_id(self) -> Optional[int]:
+        now = datetime.datetime.now()
+        with self._lock:
+            if time.monotonic() < self._expires_at and (self._valid_until is None or now < self._valid_until):
+                return self._epoch_id
+        epoch_id, valid_until = self._resolve(now)
+        with self._lock:
+            self._epoch_id = epoch_id
+            self._valid_until = valid_until
+            self._expires_at = time.monotonic() + self.ttl
+        return epoch_id
+
+    def invalidate(self):
+        with self._lock:
+            self._expires_at = 0.0
+
+    @staticmethod
+    def _resolve(now: datetime.datetime):
+        """
+        :return: (epoch_id, 结果失效的时间)，None 表示只受 ttl 限制
+        """
+        next_epoch: TeamBattleEpoch = TeamBattleEpoch.query \
+            .filter(TeamBattleEpoch.from_date > now) \
+            .order_by(TeamBattleEpoch.from_date).first()
+        next_start = next_epoch.from_date if next_epoch else None
+        current: TeamBattleEpoch = TeamBattleEpoch.query \
+            .filter(TeamBattleEpoch.from_date <= now, TeamBattleEpoch.end_date >= now) \
+            .order_by(TeamBattleEpoch.from_date.desc()).first()
+        if current:
+            valid_until = current.end_date
+            if next_start and next_start < valid_until:
+                valid_until = next_start
+            return current.id, valid_until
+        latest: TeamBattleEpoch = TeamBattleEpoch.query \
+            .filter(TeamBattleEpoch.from_date <= now) \
+            .order_by(TeamBattleEpoch.end_date.desc()).first()
+        return (latest.id if latest else None), next_start
+
+
+epoch_resolver = EpochResolver(ttl=getattr(Config, 'EPOCH_CACHE_TTL', 300))
+
+
+def current_epoch_id() -> Optional[int]:
+    return epoch_resolver.current_epoch_id()
+
+
+def _mark_epochs_changed(mapper, connection, target):
+    object_session(target).info['epochs_changed'] = True
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(TeamBattleEpoch, _event_name, _mark_epochs_changed)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_epoch(session):
+    if session.info.pop('epochs_changed', False):
+        epoch_resolver.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_epochs_changed(session):
+    session.info.pop('epochs_changed', None)
@@ -1,15 +1,71 @@
-from flask import request, jsonify, g
+from flask import request, jsonify, g, Response, stream_with_context
 import datetime
 from ..auth_tools import login_required
 from data.model import *
 from data.alchemy_encoder import AlchemyEncoder
 import json as js
 from . import record_blueprint
-from .record_tools import make_new_team_record
+from .record_tools import make_new_team_record, read_team_record
+from server_app.group_tools import group_etag
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import Session
+from config import Config
+import base64
+
+
+def encode_cursor(type_: str, date: datetime.datetime, id_: int) -> str:
+    raw = js.dumps([type_, date.isoformat(), id_], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def stream_records(current_time: int, first, rows, deleted: list, session: Session):
+    """
+    逐批输出 get_records 的 JSON，内容与一次性 js.dumps 的结果完全相同。
+    :param first: rows 的第一条记录（已经取出，用于判断是否为空）
+    :param rows: 剩余的记录，通过 yield_per 从数据库逐批读取
+    :param session: 读取 rows 使用的独立 Session，输出结束（或客户端断开）时关闭
+    """
+    try:
+        encoder = AlchemyEncoder()
+        batch_size = getattr(Config, 'STREAM_RECORDS_BATCH_SIZE', 500)
+        yield '{"time": ' + encoder.encode(current_time) + ', "data": '
+        if first is None:
+            yield '{}'
+        else:
+            yield '['
+            separator = ''
+            batch = [encoder.encode(first)]
+            for row in rows:
+                batch.append(encoder.encode(row))
+                if len(batch) >= batch_size:
+                    yield separator + ', '.join(batch)
+                    separator = ', '
+                    batch = list()
+            if batch:
+                yield separator + ', '.join(batch)
+            yield ']'
+        yield ', "deleted": ' + encoder.encode(deleted if deleted else dict()) + ', "next_cursor": null}'
+    finally:
+        session.close()
+
+
+def decode_cursor(type_: str, cursor: str):
+    """
+    :return: (date, id)，cursor 不合法或者不是这个 type 的 cursor 时返回 None
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        cursor_type, date, id_ = js.loads(raw)
+        if cursor_type != type_:
+            return None
+        return datetime.datetime.fromisoformat(date), int(id_)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
 
 
 @record_blueprint.route('/get_records', methods=['GET'])
 @login_required
+@group_etag(skip=lambda: request.args.get('type', 'personal') == 'team_rank')
 def get_records():
     """
     @api {post} /v1/record/get_records 获取XX记录列表
@@ -18,15 +74,19 @@ def get_records():
     @apiGroup Records
     @apiParam {String}  type              (必要)    personal：个人出刀记录/team：公会状态记录/team_rank: 公会排名记录
     @apiParam {int}     limit             (可选)    多少条数据
-    @apiParam {String}  page              (可选)    第几页(如果提供page则必须提供limit）(0为第一页）
+    @apiParam {String}  page              (可选)    第几页(如果提供page则必须提供limit）(0为第一页）（建议改用cursor）
+    @apiParam {String}  cursor            (可选)    上一次返回的 next_cursor，获取下一页（需要提供limit）
     @apiParam {int}     start_date        (可选)    开始日期时间戳（秒）
     @apiParam {int}     end_date          (可选)    结束日期时间戳（秒）
+    @apiParam {int}     battle_day        (可选)    只返回这一个会战日（YYYYMMDD，五点切换）的出刀，仅用于 personal
     @apiParam {int}     last_updated      (可选)    在此时间之后更新的记录会被返回，deleted 项会记录在此时间之后删除的项。
-    @apiDescription 返回公会中的出刀/状态/排名历史。
+    @apiHeader {String} If-None-Match  (可选)    上一次返回的 ETag，公会数据没有变化时返回 304（team_rank 除外）
+    @apiDescription 返回公会中的出刀/状态/排名历史。没有提供limit时分批读取并以流的形式返回，内容与一次返回相同。
 
 
     @apiSuccess (回参) {String}           msg   为"Successful!"
     @apiSuccess (回参) {List[Dictionary]} data  相应的Records，具体内容参照PersonalRecord/TeamRecord表
+    @apiSuccess (回参) {String}           next_cursor  提供了limit并且还有下一页时为下一页的cursor，否则为null
 
     @apiSuccessExample {json} 没有更新
         HTTP/1.1 304 Not Modified
@@ -36,6 +96,10 @@ def get_records():
         HTTP/1.1 416 Whatever
         {"msg": "Illegal type parameter."}
 
+    @apiErrorExample {json} cursor 不合法
+        HTTP/1.1 400 Bad Request
+        {"msg": "Illegal cursor parameter."}
+
     @apiErrorExample {json} 用户没有加入公会
         HTTP/1.1 403 Forbidden
         {"msg": "User is not in any group."}
@@ -52,6 +116,8 @@ def get_records():
     end_date: str = request.args.get('end_date', '')
     type_: str = request.args.get('type', 'personal')
     last_updated = request.args.get('last_updated', '')
+    cursor: str = request.args.get('cursor', '')
+    battle_day: str = request.args.get('battle_day', '')
 
     current_time = int(datetime.datetime.timestamp(datetime.datetime.now()))
 
@@ -65,21 +131,25 @@ def get_records():
     deleted = DeletionHistory.query.filter_by(group_id=group.id)
 
     if type_ == 'team':
-        records = group.team_record.order_by(TeamRecord.last_modified.desc()).first()
+        records = read_team_record(group_id=group.id, data_version=group.data_version)
         if not records:
             make_new_team_record(group_id=group.id)
-            records = group.team_record.order_by(TeamRecord.last_modified.desc()).first()
+            records = read_team_record(group_id=group.id, data_version=group.data_version)
         return js.dumps({
             "data": records
         }, cls=AlchemyEncoder), 200
     elif type_ == 'personal':
         records = group.personal_records
         date_type = PersonalRecord.detail_date
+        id_type = PersonalRecord.id
         last_modified = PersonalRecord.last_modified
         deleted = deleted.filter(DeletionHistory.from_table == 'PersonalRecord')
+        if battle_day.isdigit():
+            records = records.filter(PersonalRecord.battle_day == int(battle_day))
     elif type_ == 'team_rank':
         records = group.team_ranks
         date_type = TeamRank.record_date
+        id_type = TeamRank.id
         last_modified = TeamRank.record_date
         deleted = deleted.filter(DeletionHistory.from_table == 'TeamRank')
     else:
@@ -90,16 +160,42 @@ def get_records():
     if end_date.isdigit() and end_date != -1:
         end = datetime.datetime.fromtimestamp(int(end_date))
         records = records.filter(date_type <= end)
-    if limit.isdigit() and limit != 0:
-        records = records.limit(int(limit))
-        if page.isdigit() and page != 0:
-            records = records.offset(int(limit) * int(page))
     if last_updated.isdigit():
         last_updated_date = datetime.datetime.fromtimestamp(int(last_updated))
         records = records.filter(last_modified >= last_updated_date)
         deleted = deleted.filter(DeletionHistory.deleted_date >= last_updated_date)
+    if cursor:
+        position = decode_cursor(type_, cursor)
+        if position is None:
+            return jsonify({"msg": "Illegal cursor parameter."}), 400
+        # 从上一页最后一条之后继续，不需要扫描前面的页；date_type <= 让数据库可以直接在索引上定位
+        records = records.filter(date_type <= position[0],
+                                 or_(date_type < position[0], and_(date_type == position[0], id_type < position[1])))
+    # 同一时间的记录按 id 排序，保证翻页时顺序稳定
+    records = records.order_by(date_type.desc(), id_type.desc())
 
-    records_list: dict = records.order_by(date_type.desc()).all()
+    next_cursor = None
+    if limit.isdigit() and int(limit) != 0:
+        if page.isdigit() and not cursor:
+            records = records.offset(int(limit) * int(page))
+        # 多取一条用来判断是否还有下一页
+        records_list = records.limit(int(limit) + 1).all()
+        if len(records_list) > int(limit):
+            records_list = records_list[:int(limit)]
+            last = records_list[-1]
+            next_cursor = encode_cursor(type_, getattr(last, date_type.key), last.id)
+    else:
+        # 没有 limit 时逐批读取、逐批输出，内存占用与记录总数无关。
+        # MySQL (pymysql) 的 yield_per 结果未读完时，同一连接上的下一条查询会丢弃剩余的结果，
+        # 所以先完成其他查询，记录本身在独立的连接上读取。
+        deleted = deleted.all()
+        session = Session(bind=db.engine)
+        rows = iter(records.with_session(session).yield_per(getattr(Config, 'STREAM_RECORDS_BATCH_SIZE', 500)))
+        first = next(rows, None)
+        if last_updated.isdigit() and first is None and not deleted:
+            session.close()
+            return '', 304  # 如果没有更新
+        return Response(stream_with_context(stream_records(current_time, first, rows, deleted, session)), 200)
     deleted = deleted.all()
 
     # db.session.commit()
@@ -114,18 +210,21 @@ def get_records():
     return js.dumps({
         "time": current_time,
         "data": records_list,
-        "deleted": deleted
+        "deleted": deleted,
+        "next_cursor": next_cursor
     }, cls=AlchemyEncoder), 200
 
 
 @record_blueprint.route('/get_current_team_record', methods=['GET'])
 @login_required
+@group_etag()
 def get_current_team_record():
     """
     @api {post} /v1/record/get_current_team_record 获取公会boss状态
     @apiVersion 1.0.0
     @apiName get_current_team_record
     @apiGroup Records
+    @apiHeader {String} If-None-Match  (可选)    上一次返回的 ETag，公会数据没有变化时返回 304
     @apiDescription 获取公会boss状态
 
 
@@ -150,10 +249,10 @@ def get_current_team_record():
     if not group:
         return jsonify({"msg": "User's group not found."}), 417
 
-    current_record = TeamRecord.query.filter(TeamRecord.group_id == user.group_id)\
-        .order_by(TeamRecord.last_modified.desc()).first()
+    current_record = read_team_record(group_id=group.id, data_version=group.data_version)
     if not current_record:
-        current_record = make_new_team_record(group_id=group.id)
+        make_new_team_record(group_id=group.id)
+        current_record = read_team_record(group_id=group.id, data_version=group.data_version)
 
     return js.dumps({
         "data": current_record
@@ -0,0 +1,80 @@
+from data.model import User
+from .record_tools import GroupCache
+from collections import Counter, defaultdict, namedtuple
+from typing import Optional
+import unicodedata
+from config import Config
+
+NicknameMatch = namedtuple('NicknameMatch', ['user_id', 'nickname', 'confidence'])
+
+
+def normalize_nickname(name: str) -> str:
+    # NFKC 把全角字母数字、半角片假名等统一成同一种写法
+    return ''.join(unicodedata.normalize('NFKC', name).casefold().split())
+
+
+def nickname_bigrams(name: str) -> Counter:
+    # 首尾补位，单字的名字也能得到二元组
+    padded = '\x02' + normalize_nickname(name) + '\x03'
+    return Counter(padded[i:i + 2] for i in range(len(padded) - 1))
+
+
+class NicknameIndex:
+    """
+    公会成员游戏名的二元组倒排索引，用于把 OCR 识别出的名字对应到成员。
+    相似度为两个名字二元组的 Dice 系数（0 到 1）。
+    """
+
+    def __init__(self, members: list):
+        self.members = list()
+        self.postings = defaultdict(list)
+        for user_id, nickname in members:
+            bigrams = nickname_bigrams(nickname)
+            index = len(self.members)
+            self.members.append((user_id, nickname, bigrams, sum(bigrams.values())))
+            for bigram, count in bigrams.items():
+                self.postings[bigram].append((index, count))
+
+    def match(self, name: str) -> Optional[NicknameMatch]:
+        bigrams = nickname_bigrams(name)
+        total = sum(bigrams.values())
+        overlaps = defaultdict(int)
+        for bigram, count in bigrams.items():
+            for index, member_count in self.postings.get(bigram, ()):
+                overlaps[index] += min(count, member_count)
+        best = None
+        for index, overlap in overlaps.items():
+            user_id, nickname, _, member_total = self.members[index]
+            confidence = 2 * overlap / (total + member_total)
+            if best is None or confidence > best.confidence:
+                best = NicknameMatch(user_id, nickname, confidence)
+        return best
+
+
+nickname_index_cache = GroupCache(max_size=getattr(Config, 'NICKNAME_INDEX_CACHE_SIZE', 1024),
+                                  ttl=getattr(Config, 'NICKNAME_INDEX_CACHE_TTL', 60))
+
+
+def get_nickname_index(group_id: int) -> NicknameIndex:
+    index = nickname_index_cache.get(group_id)
+    if index is None:
+        members = User.query.with_entities(User.id, User.nickname).filter(User.group_id == group_id).all()
+        index = NicknameIndex(members)
+        nickname_index_cache.set(group_id, index)
+    return index
+
+
+def invalidate_nickname_index(group_id: int):
+    # 成员加入、退出或修改游戏名后调用
+    nickname_index_cache.invalidate(group_id)
+
+
+def match_nickname(name: str, group_id: int) -> Optional[NicknameMatch]:
+    """
+    在公会成员中查找与 name 最接近的游戏名。
+    :return: 相似度不低于 NICKNAME_MATCH_THRESHOLD 的最佳匹配，没有则为 None
+    """
+    match = get_nickname_index(group_id).match(name)
+    if match is None or match.confidence < getattr(Config, 'NICKNAME_MATCH_THRESHOLD', 0.34):
+        return None
+    return match
@@ -0,0 +1,95 @@
+from data.model import *
+from sqlalchemy import or_, and_
+from datetime import datetime, timedelta
+
+
+def hot_queries(group_id: int = 1) -> list:
+    """
+    出刀相关接口中最频繁的查询，以及它们应该使用的索引。
+    :return: [(名称, Query, 索引名)]
+    """
+    now = datetime.now()
+    return [
+        # get_records.py：type=personal，按时间范围
+        ('get_records personal by date',
+         PersonalRecord.query.filter(PersonalRecord.group_id == group_id,
+                                     PersonalRecord.detail_date >= now - timedelta(days=7),
+                                     PersonalRecord.detail_date <= now)
+         .order_by(PersonalRecord.detail_date.desc()),
+         'ix_personal_record_group_id_detail_date'),
+        # get_records.py：type=personal，battle_day 指定会战日
+        ('get_records personal by battle day',
+         PersonalRecord.query.filter(PersonalRecord.group_id == group_id,
+                                     PersonalRecord.battle_day == int(now.strftime('%Y%m%d')))
+         .order_by(PersonalRecord.detail_date.desc(), PersonalRecord.id.desc()),
+         'ix_personal_record_group_id_battle_day'),
+        # get_records.py：type=personal，last_updated 增量同步
+        ('get_records personal since last_updated',
+         PersonalRecord.query.filter(PersonalRecord.group_id == group_id,
+                                     PersonalRecord.last_modified >= now - timedelta(minutes=5)),
+         'ix_personal_record_group_id_last_modified'),
+        # get_records.py：按 cursor 翻页
+        ('get_records personal after cursor',
+         PersonalRecord.query.filter(PersonalRecord.group_id == group_id,
+                                     PersonalRecord.detail_date <= now,
+                                     or_(PersonalRecord.detail_date < now,
+                                         and_(PersonalRecord.detail_date == now, PersonalRecord.id < 1000)))
+         .order_by(PersonalRecord.detail_date.desc(), PersonalRecord.id.desc()).limit(21),
+         'ix_personal_record_group_id_detail_date'),
+        ('get_records team_rank after cursor',
+         TeamRank.query.filter(TeamRank.group_id == group_id,
+                               TeamRank.record_date <= now,
+                               or_(TeamRank.record_date < now,
+                                   and_(TeamRank.record_date == now, TeamRank.id < 1000)))
+         .order_by(TeamRank.record_date.desc(), TeamRank.id.desc()).limit(21),
+         'ix_team_rank_group_id_record_date'),
+        # get_records.py：last_updated 之后删除的记录
+        ('get_records deleted since last_updated',
+         DeletionHistory.query.filter(DeletionHistory.group_id == group_id,
+                                      DeletionHistory.from_table == 'PersonalRecord',
+                                      DeletionHistory.deleted_date >= now - timedelta(minutes=5)),
+         'ix_deletion_history_group_id_from_table_deleted_date'),
+        # record.py / add_record_if_needed.py：读取公会当前状态
+        ('current team record',
+         TeamRecord.query.filter(TeamRecord.group_id == group_id)
+         .order_by(TeamRecord.last_modified.desc()).limit(1),
+         'ix_team_record_group_id_last_modified'),
+        # changes.py：增量同步
+        ('changes since seq',
+         ChangeLog.query.filter(ChangeLog.group_id == group_id, ChangeLog.seq > 100)
+         .order_by(ChangeLog.seq, ChangeLog.id).limit(1001),
+         'ix_change_log_group_id_seq'),
+        # add_record_if_needed.py：重新加载 OCR 去重用的近期出刀
+        ('add_record_if_needed recent damage',
+         PersonalRecord.query.with_entities(PersonalRecord.damage, PersonalRecord.real_damage,
+                                            PersonalRecord.nickname, PersonalRecord.detail_date)
+         .filter(PersonalRecord.group_id == group_id,
+                 PersonalRecord.detail_date > now - timedelta(days=1)),
+         'ix_personal_record_group_id_detail_date'),
+    ]
+
+
+def explain(query) -> list:
+    """
+    对 query 执行 EXPLAIN（SQLite 为 EXPLAIN QUERY PLAN），返回每一行的文本。
+    """
+    bind = db.session.get_bind()
+    compiled = query.statement.compile(dialect=bind.dialect)
+    prefix = 'EXPLAIN QUERY PLAN ' if bind.dialect.name == 'sqlite' else 'EXPLAIN '
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    rows = db.session.connection().execute(prefix + str(compiled), params).fetchall()
+    return [' '.join(str(value) for value in row) for row in rows]
+
+
+def check_query_plans(group_id: int = 1) -> list:
+    """
+    :return: [(名称, 是否使用了预期的索引, EXPLAIN 输出)]
+    """
+    results = list()
+    for name, query, index in hot_queries(group_id):
+        plan = explain(query)
+        results.append((name, any(index in row for row in plan), plan))
+    return results
@@ -2,13 +2,17 @@ from flask import request, jsonify, g
 import datetime
 from ..auth_tools import login_required
 from data.model import *
-from .record_tools import damage_to_score, subtract_damage_from_group, make_new_team_record
+from .record_tools import damage_to_score, subtract_damage_from_group, make_new_team_record, \
+    get_team_record, read_team_record, invalidate_team_record
+from .duplicate_tools import remember_damage, invalidate_recent_damage
+from .summary_tools import add_to_summary
+from .epoch_tools import current_epoch_id
 from data.alchemy_encoder import AlchemyEncoder
 import json as js
 from . import record_blueprint
 from config import Config
-from server_app.push_notification_tools import push_ios
-from server_app.qq_tools import send_message_to_qq
+from server_app.notification_tools import notification_coalescer, boss_status
+from server_app.group_tools import bump_data_version
 
 
 @record_blueprint.route('/add_record', methods=['POST'])
@@ -46,6 +50,10 @@ def add_record():
         HTTP/1.1 412 Precondition Failed
         {"msg": "Group doesn't have a user with this ID."}
 
+    @apiErrorExample {json} 还没有开始的会战
+        HTTP/1.1 412 Precondition Failed
+        {"msg": "Team battle has not started."}
+
     """
     user: User = g.user
 
@@ -71,52 +79,50 @@ def add_record():
     group: Group = user.group
     if not group:
         return jsonify({"msg": "User's group not found."}), 417
-    team_record: TeamRecord = group.team_record \
-        .order_by(TeamRecord.last_modified.desc()).first()
+    epoch_id = current_epoch_id()
+    if epoch_id is None:
+        return jsonify({"msg": "Team battle has not started."}), 412
+    team_record: TeamRecord = get_team_record(group_id=group.id, data_version=group.data_version)
     if not team_record:
         team_record = make_new_team_record(group_id=group.id)
-    else:
-        team_record.last_modified = datetime.datetime.now()
 
     if user_id:
         user_of_attack = User.query.filter_by(id=user_id, group_id=user.group_id).first()
         if not user_of_attack:
             return jsonify({"msg": "Group doesn't have a user with this ID."}), 412
         user = user_of_attack
-    if not boss_gen:
-        boss_gen = team_record.current_boss_gen
-    if not boss_order:
-        boss_order = team_record.current_boss_order
-
-    if not damage:
-        damage = team_record.boss_remaining_health
 
     added_record: PersonalRecord = PersonalRecord(group_id=user.group_id,
-                                                  boss_gen=boss_gen,
-                                                  boss_order=boss_order,
-                                                  damage=int(damage),
                                                   user_id=user.id,
                                                   nickname=user.nickname,
                                                   detail_date=datetime.datetime.now(),
                                                   type=type_,
                                                   last_modified=datetime.datetime.now(),
-                                                  epoch_id=team_record.epoch_id)
-    added_record.score = damage_to_score(record=added_record)
-    subtract_damage_from_group(record=added_record, team_record=team_record)
+                                                  epoch_id=epoch_id)
+
+    def assign_target(current: TeamRecord):
+        # 没有指定的 boss 和尾刀伤害按扣血时的 boss 状态补全
+        added_record.boss_gen = boss_gen or current.current_boss_gen
+        added_record.boss_order = boss_order or current.current_boss_order
+        added_record.damage = int(damage or current.boss_remaining_health)
+        added_record.score = damage_to_score(record=added_record)
+
+    subtract_damage_from_group(record=added_record, team_record=team_record, assign_target=assign_target)
     db.session.add(added_record)
+    bump_data_version(group.id)
+    add_to_summary(added_record)
 
     db.session.commit()
     db.session.refresh(added_record)
-    db.session.refresh(team_record)
+    remember_damage(group.id, added_record.damage, added_record.nickname, added_record.detail_date,
+                    group.data_version)
+    team_record = read_team_record(group_id=group.id)
     return_data = {
         "msg": "Successful!",
         "record": added_record,
         "team_record": team_record
     }
 
-    user_name_list = []
-    for user_obj in group.users:
-        user_name_list.append(user_obj.username)
     content = user.nickname
     content += '对' + str(added_record.boss_order) + '王'
     content += '造成了' + str(added_record.damage) + '点伤害'
@@ -125,7 +131,6 @@ def add_record():
     else:
         content += str(team_record.current_boss_order) + \
                    '王血量还剩' + str(team_record.boss_remaining_health) + '。'
-    push_ios(user_name_list, '添加了新纪录', '', content)
 
     origin = origin if origin else '客户端'
     msg = '通过' + origin + '添加了新的记录喵！'
@@ -133,11 +138,13 @@ def add_record():
     msg += '\n' + '当前为' + str(team_record.current_boss_gen) + '周目'
 
     if origin == "QQ":
+        notification_coalescer.add(group.id, content, boss_status(team_record))
         return_data = dict(message=msg, id=group.group_chat_id, type='group')
         return jsonify(return_data), 200
     else:
         headers = dict(auth=request.headers.get('auth'))
-        send_message_to_qq(message=msg, id_=group.group_chat_id, type_='group', header=headers)
+        notification_coalescer.add(group.id, content, boss_status(team_record),
+                                   qq_message=msg, qq_chat_id=group.group_chat_id, qq_header=headers)
         return js.dumps(return_data, cls=AlchemyEncoder), 200
 
 
@@ -204,15 +211,23 @@ def modify_record():
             return jsonify({'msg': 'Record not found'}), 410
         # 3.1 判断是否是本人操作
         if r.user.id == user.id or user.role != 0:
+            # 先从修改前的会战日合计中减去
+            add_to_summary(r, sign=-1)
             if damage:
-                r.damage = damage
+                r.damage = int(damage)
             if type_:
                 r.type = type_
             if boss_order:
-                r.boss_order = boss_order
+                r.boss_order = int(boss_order)
             if boss_gen:
-                r.boss_gen = boss_gen
+                r.boss_gen = int(boss_gen)
+            r.score = damage_to_score(record=r)
+            r.last_modified = datetime.datetime.now()
+            bump_data_version(user.group_id)
+            add_to_summary(r)
             db.session.commit()
+            invalidate_team_record(group_id=user.group_id)
+            invalidate_recent_damage(group_id=user.group_id)
             return js.dumps({
                 "team_record": r
             }, cls=AlchemyEncoder), 200
@@ -1,6 +1,144 @@
-from data.model import PersonalRecord, TeamRecord, TeamBattleEpoch, db
+from data.model import PersonalRecord, TeamRecord, db
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple, List
 import datetime
+import threading
+import time
 from config import Config
+from server_app.group_tools import bump_data_version
+from server_app.change_log_tools import log_change
+from .epoch_tools import current_epoch_id
+
+TEAM_RECORD_COLUMNS = ('id', 'epoch_id', 'group_id', 'current_boss_gen',
+                       'current_boss_order', 'boss_remaining_health', 'last_modified')
+
+
+class GroupCache:
+    """
+    按公会 ID 缓存数据的 LRU 缓存，最多保存 max_size 个公会。
+    多个 worker 之间不共享缓存，所以每一项只在 ttl 秒内有效。
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, group_id: int):
+        with self._lock:
+            item = self._data.get(group_id)
+            if item is None:
+                return None
+            cached_at, value = item
+            if time.monotonic() - cached_at > self.ttl:
+                del self._data[group_id]
+                return None
+            self._data.move_to_end(group_id)
+            return value
+
+    def set(self, group_id: int, value):
+        with self._lock:
+            self._data[group_id] = (time.monotonic(), value)
+            self._data.move_to_end(group_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, group_id: int):
+        with self._lock:
+            self._data.pop(group_id, None)
+
+
+# 当前 boss 状态（最新的 TeamRecord），每一项为 (公会的 data_version, 各列的值)。
+# 只保存各列的值，每次取用时重新构造对象，避免在不同请求的 Session 之间共享实例。
+# 其他 worker 修改后公会的 data_version 会变化，调用时提供 data_version 就不会读到过期的状态；
+# 本 worker 写入的状态不知道提交后的 data_version，记为 None，下一次带版本的读取会重新查询一次。
+team_record_cache = GroupCache(max_size=getattr(Config, 'TEAM_RECORD_CACHE_SIZE', 1024),
+                               ttl=getattr(Config, 'TEAM_RECORD_CACHE_TTL', 5))
+
+
+def snapshot_of(team_record: TeamRecord) -> dict:
+    return {column: getattr(team_record, column) for column in TEAM_RECORD_COLUMNS}
+
+
+def stage_team_record(team_record: TeamRecord, changed: bool = True):
+    # 提交成功后才写入缓存，回滚时丢弃
+    db.session.info.setdefault('staged_team_records', {})[team_record.group_id] = snapshot_of(team_record)
+    if changed:
+        # boss 状态是用 UPDATE 直接写入的，Session 不知道这次修改
+        log_change(team_record.group_id, 'team_record', team_record.id, 'update')
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_staged_team_records(session):
+    for group_id, snapshot in session.info.pop('staged_team_records', {}).items():
+        team_record_cache.set(group_id, (None, snapshot))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_staged_team_records(session):
+    for group_id in session.info.pop('staged_team_records', {}):
+        team_record_cache.invalidate(group_id)
+
+
+def invalidate_team_record(group_id: int):
+    team_record_cache.invalidate(group_id)
+
+
+def _cached_snapshot(group_id: int, data_version: Optional[int]) -> Optional[dict]:
+    item = team_record_cache.get(group_id)
+    if item is None:
+        return None
+    cached_version, snapshot = item
+    if data_version is not None and cached_version != data_version:
+        return None
+    return snapshot
+
+
+def _load_team_record(group_id: int, data_version: Optional[int] = None) -> Optional[TeamRecord]:
+    team_record = TeamRecord.query.filter(TeamRecord.group_id == group_id) \
+        .order_by(TeamRecord.last_modified.desc()).first()
+    if team_record:
+        # 读到的状态不会比 data_version 更旧，最多多查询一次
+        team_record_cache.set(group_id, (data_version, snapshot_of(team_record)))
+    return team_record
+
+
+def get_team_record(group_id: int, data_version: Optional[int] = None) -> Optional[TeamRecord]:
+    """
+    获取公会当前的 TeamRecord，用于修改。
+    缓存命中时直接把缓存的值挂到当前 Session 上，不需要再查询数据库。
+    :param data_version: 公会当前的 data_version，缓存的状态不是这个版本时重新查询
+    """
+    snapshot = _cached_snapshot(group_id, data_version)
+    if snapshot is None:
+        return _load_team_record(group_id, data_version)
+    existing = db.session.identity_map.get(identity_key(TeamRecord, snapshot['id']))
+    if existing is not None:
+        return existing
+    team_record = TeamRecord(**snapshot)
+    make_transient_to_detached(team_record)
+    db.session.add(team_record)
+    return team_record
+
+
+def read_team_record(group_id: int, data_version: Optional[int] = None) -> Optional[TeamRecord]:
+    """
+    获取公会当前的 TeamRecord，只用于读取和序列化。
+    返回的对象不在 Session 中，序列化时不会触发关联查询。
+    :param data_version: 公会当前的 data_version，缓存的状态不是这个版本时重新查询
+    """
+    snapshot = _cached_snapshot(group_id, data_version)
+    if snapshot is None:
+        team_record = _load_team_record(group_id, data_version)
+        if not team_record:
+            return None
+        snapshot = snapshot_of(team_record)
+    return TeamRecord(**snapshot)
 
 
 def damage_to_score(record: PersonalRecord) -> int:
@@ -12,30 +150,145 @@ def damage_to_score(record: PersonalRecord) -> int:
     return int(int(record.damage) * multiplier[int(record.boss_order)-1])
 
 
-def subtract_damage_from_group(record: PersonalRecord, team_record: TeamRecord):
-    #  计算boss剩余血量
-    damage = int(record.damage)
-    if damage < team_record.boss_remaining_health:
-        team_record.boss_remaining_health -= damage
+def next_boss_state(boss_gen: int, boss_order: int, remaining_health: int, damage: int) -> Tuple[int, int, int]:
+    #  计算出刀后的 (周目, boss编号, boss剩余血量)
+    if damage < remaining_health:
+        return boss_gen, boss_order, remaining_health - damage
+    if boss_order < 5:
+        boss_order += 1
     else:
-        if team_record.current_boss_order < 5:
-            team_record.current_boss_order += 1
-        else:
-            team_record.current_boss_order = 1
-            team_record.current_boss_gen += 1
-        team_record.boss_remaining_health = Config.BOSS_HEALTH[team_record.current_boss_order-1]
+        boss_order = 1
+        boss_gen += 1
+    return boss_gen, boss_order, Config.BOSS_HEALTH[boss_order-1]
+
+
+def _current_boss_query(team_record: TeamRecord, boss_gen: int, boss_order: int):
+    return TeamRecord.query.filter(TeamRecord.id == team_record.id,
+                                   TeamRecord.current_boss_gen == boss_gen,
+                                   TeamRecord.current_boss_order == boss_order)
+
+
+def _boss_state_values(boss_gen: int, boss_order: int, remaining_health: int, now: datetime.datetime) -> dict:
+    return {TeamRecord.current_boss_gen: boss_gen,
+            TeamRecord.current_boss_order: boss_order,
+            TeamRecord.boss_remaining_health: remaining_health,
+            TeamRecord.last_modified: now}
+
+
+def _set_boss_state(team_record: TeamRecord, boss_gen: int, boss_order: int, remaining_health: int,
+                    now: datetime.datetime):
+    # UPDATE 已经写入数据库，这里只同步对象上的值，不产生新的修改
+    set_committed_value(team_record, 'current_boss_gen', boss_gen)
+    set_committed_value(team_record, 'current_boss_order', boss_order)
+    set_committed_value(team_record, 'boss_remaining_health', remaining_health)
+    set_committed_value(team_record, 'last_modified', now)
+    stage_team_record(team_record)
+
+
+def _lock_team_record(team_record: TeamRecord):
+    # 锁住这一行直到事务提交，并把对象上的值更新为数据库中最新的状态
+    TeamRecord.query.filter(TeamRecord.id == team_record.id) \
+        .with_for_update().populate_existing().one()
+
+
+def subtract_damage_from_group(record: PersonalRecord, team_record: TeamRecord,
+                               assign_target: Optional[Callable[[TeamRecord], None]] = None):
+    """
+    计算boss剩余血量，通过带条件的 UPDATE 写入数据库。
+    出刀中没有指定的 boss、伤害等由 assign_target 按公会状态补全。
+    手上的状态（可能来自缓存）已经过期时，锁住这一行，按最新状态重新补全后再扣血，
+    出刀因此总是记在扣血的那个 boss 上。
+    """
+    if assign_target is not None:
+        assign_target(team_record)
+    state = (team_record.current_boss_gen, team_record.current_boss_order, team_record.boss_remaining_health)
+    now = datetime.datetime.now()
+
+    if (int(record.boss_gen), int(record.boss_order)) == state[:2]:
+        # 先假设手上的状态是最新的，一条 UPDATE 完成
+        new_gen, new_order, new_health = next_boss_state(*state, int(record.damage))
+        updated = _current_boss_query(team_record, state[0], state[1]) \
+            .filter(TeamRecord.boss_remaining_health == state[2]) \
+            .update(_boss_state_values(new_gen, new_order, new_health, now), synchronize_session=False)
+        if updated:
+            _set_boss_state(team_record, new_gen, new_order, new_health, now)
+            return
+
+    # 状态已被其他请求修改（或缓存过期）
+    _lock_team_record(team_record)
+    if assign_target is not None:
+        assign_target(team_record)
+    if (int(record.boss_gen), int(record.boss_order)) != \
+            (team_record.current_boss_gen, team_record.current_boss_order):
+        # 指定的 boss 已经被击破，不修改当前状态，只用读到的最新状态更新缓存
+        stage_team_record(team_record, changed=False)
+        return
+    new_gen, new_order, new_health = next_boss_state(team_record.current_boss_gen, team_record.current_boss_order,
+                                                     team_record.boss_remaining_health, int(record.damage))
+    TeamRecord.query.filter(TeamRecord.id == team_record.id) \
+        .update(_boss_state_values(new_gen, new_order, new_health, now), synchronize_session=False)
+    _set_boss_state(team_record, new_gen, new_order, new_health, now)
+
+
+def replay_damages(attacks: List[dict], state: Tuple[int, int, int]) -> Tuple[List[dict], Tuple[int, int, int]]:
+    """
+    在内存中按顺序重放多次出刀。
+    没有指定 boss 的出刀算作当时的 boss，没有伤害的尾刀按当时的剩余血量计算。
+    :return: [补全了 boss_gen/boss_order/damage 的出刀], (周目, boss编号, boss剩余血量)
+    """
+    boss_gen, boss_order, remaining_health = state
+    replayed = []
+    for attack in attacks:
+        attack = dict(attack)
+        attack['boss_gen'] = int(attack.get('boss_gen') or boss_gen)
+        attack['boss_order'] = int(attack.get('boss_order') or boss_order)
+        attack['damage'] = int(attack.get('damage') or remaining_health)
+        if (attack['boss_gen'], attack['boss_order']) == (boss_gen, boss_order):
+            boss_gen, boss_order, remaining_health = next_boss_state(boss_gen, boss_order,
+                                                                     remaining_health, attack['damage'])
+        replayed.append(attack)
+    return replayed, (boss_gen, boss_order, remaining_health)
+
+
+def subtract_damages_from_group(attacks: List[dict], team_record: TeamRecord) -> List[dict]:
+    """
+    批量出刀时使用：重放所有出刀后只写一次 boss 状态。
+    手上的状态过期时锁住这一行，按最新状态重新计算。
+    """
+    state = (team_record.current_boss_gen, team_record.current_boss_order, team_record.boss_remaining_health)
+    replayed, (new_gen, new_order, new_health) = replay_damages(attacks, state)
+    now = datetime.datetime.now()
+    updated = _current_boss_query(team_record, state[0], state[1]) \
+        .filter(TeamRecord.boss_remaining_health == state[2]) \
+        .update(_boss_state_values(new_gen, new_order, new_health, now), synchronize_session=False)
+    if not updated:
+        _lock_team_record(team_record)
+        state = (team_record.current_boss_gen, team_record.current_boss_order, team_record.boss_remaining_health)
+        replayed, (new_gen, new_order, new_health) = replay_damages(attacks, state)
+        TeamRecord.query.filter(TeamRecord.id == team_record.id) \
+            .update(_boss_state_values(new_gen, new_order, new_health, now), synchronize_session=False)
+    _set_boss_state(team_record, new_gen, new_order, new_health, now)
+    return replayed
 
 
 def make_new_team_record(group_id: int) -> TeamRecord:
-    current_epoch: TeamBattleEpoch = TeamBattleEpoch.query \
-        .order_by(TeamBattleEpoch.end_date.desc()).limit(1).first()
-    team_record = TeamRecord(epoch_id=current_epoch.id,
-                             group_id=group_id,
-                             current_boss_gen=1,
-                             current_boss_order=1,
-                             boss_remaining_health=Config.BOSS_HEALTH[0],
-                             last_modified=datetime.datetime.now())
-    db.session.add(team_record)
+    """
+    公会第一次出刀时创建 TeamRecord。
+    先锁住公会一行，再用加锁的读取检查一次，同时到达的多个第一刀只会创建一条记录。
+    """
+    bump_data_version(group_id)
+    team_record = TeamRecord.query.filter(TeamRecord.group_id == group_id) \
+        .order_by(TeamRecord.last_modified.desc()).with_for_update().first()
+    if team_record is None:
+        # 还没有任何会战时 epoch_id 为空
+        team_record = TeamRecord(epoch_id=current_epoch_id(),
+                                 group_id=group_id,
+                                 current_boss_gen=1,
+                                 current_boss_order=1,
+                                 boss_remaining_health=Config.BOSS_HEALTH[0],
+                                 last_modified=datetime.datetime.now())
+        db.session.add(team_record)
     db.session.commit()
     db.session.refresh(team_record)
+    team_record_cache.set(group_id, (None, snapshot_of(team_record)))
     return team_record
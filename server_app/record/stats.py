@@ -0,0 +1,146 @@
+from flask import request, jsonify, g
+import datetime
+from ..auth_tools import login_required
+from data.model import *
+from sqlalchemy import func, case
+from . import record_blueprint
+from .record_tools import GroupCache
+from .summary_tools import SUMMARY_COLUMNS
+from server_app.group_tools import group_etag
+from config import Config
+
+# 公会统计结果，键为 (公会 ID, 查询参数)，值为 (data_version, 结果)，公会数据变化后自然失效。
+# 每种查询参数单独占一项，所有公会共用 max_size 的上限，不会因为客户端变换日期范围而无限增长
+stats_cache = GroupCache(max_size=getattr(Config, 'STATS_CACHE_SIZE', 1024),
+                         ttl=getattr(Config, 'STATS_CACHE_TTL', 600))
+
+
+def _aggregate_columns() -> list:
+    return [func.sum(PersonalRecord.damage).label('damage'),
+            func.sum(PersonalRecord.score).label('score'),
+            func.count(PersonalRecord.id).label('attacks'),
+            func.sum(case([(PersonalRecord.type == 'last', 1)], else_=0)).label('last_hits'),
+            func.sum(case([(PersonalRecord.type == 'compensation', 1)], else_=0)).label('compensation_hits')]
+
+
+def _rows_to_dicts(rows, keys: list) -> list:
+    result = list()
+    for row in rows:
+        item = {key: getattr(row, key) for key in keys}
+        for key in SUMMARY_COLUMNS:
+            item[key] = int(getattr(row, key) or 0)
+        result.append(item)
+    return result
+
+
+def _summary_columns() -> list:
+    return [func.sum(getattr(MemberDailySummary, key)).label(key) for key in SUMMARY_COLUMNS]
+
+
+def compute_stats(group_id: int, epoch_id: int = None, start: datetime.datetime = None,
+                  end: datetime.datetime = None) -> dict:
+    """
+    在数据库中按成员、成员+会战日、成员+Boss 汇总出刀。
+    没有指定时间范围时，成员和会战日的合计从 member_daily_summary 读取（每个成员每天一行）。
+    """
+    def base_query(*keys):
+        query = db.session.query(*keys, *_aggregate_columns()) \
+            .filter(PersonalRecord.group_id == group_id)
+        if epoch_id is not None:
+            query = query.filter(PersonalRecord.epoch_id == epoch_id)
+        if start is not None:
+            query = query.filter(PersonalRecord.detail_date >= start)
+        if end is not None:
+            query = query.filter(PersonalRecord.detail_date <= end)
+        return query.group_by(*keys)
+
+    def summary_query(*keys):
+        query = db.session.query(*keys, *_summary_columns()) \
+            .filter(MemberDailySummary.group_id == group_id)
+        if epoch_id is not None:
+            query = query.filter(MemberDailySummary.epoch_id == epoch_id)
+        return query.group_by(*keys)
+
+    if start is None and end is None:
+        members = summary_query(MemberDailySummary.user_id).all()
+        by_day = summary_query(MemberDailySummary.user_id, MemberDailySummary.day) \
+            .order_by(MemberDailySummary.day).all()
+    else:
+        day = PersonalRecord.battle_day.label('day')
+        members = base_query(PersonalRecord.user_id).all()
+        by_day = base_query(PersonalRecord.user_id, day).order_by(day).all()
+    # 合计表中没有 Boss，按 Boss 的统计仍然从出刀记录汇总
+    by_boss = base_query(PersonalRecord.user_id, PersonalRecord.boss_order).order_by(PersonalRecord.boss_order).all()
+
+    nicknames = dict(User.query.with_entities(User.id, User.nickname)
+                     .filter(User.id.in_([row.user_id for row in members])).all()) if members else dict()
+    members = _rows_to_dicts(members, ['user_id'])
+    for member in members:
+        member['nickname'] = nicknames.get(member['user_id'])
+    return {
+        "members": members,
+        "by_day": _rows_to_dicts(by_day, ['user_id', 'day']),
+        "by_boss": _rows_to_dicts(by_boss, ['user_id', 'boss_order'])
+    }
+
+
+@record_blueprint.route('/stats', methods=['GET'])
+@login_required
+@group_etag()
+def get_stats():
+    """
+    @api {get} /v1/record/stats 公会成员出刀统计
+    @apiVersion 1.0.0
+    @apiName get_stats
+    @apiGroup Records
+    @apiParam {int}     epoch_id          (可选)    只统计这一期会战
+    @apiParam {int}     start_date        (可选)    开始日期时间戳（秒）
+    @apiParam {int}     end_date          (可选)    结束日期时间戳（秒）
+    @apiHeader {String} If-None-Match  (可选)    上一次返回的 ETag，公会数据没有变化时返回 304
+    @apiDescription 按成员汇总伤害、分数、出刀数、尾刀数和补偿刀数，并按会战日（五点切换）和 Boss 细分。
+
+    @apiSuccess (回参) {String}           msg       为"Successful!"
+    @apiSuccess (回参) {List[Dictionary]} members   每个成员的合计：user_id, nickname, damage, score, attacks, last_hits, compensation_hits
+    @apiSuccess (回参) {List[Dictionary]} by_day    每个成员每个会战日的合计，day 为 YYYYMMDD
+    @apiSuccess (回参) {List[Dictionary]} by_boss   每个成员对每个 Boss（boss_order）的合计
+
+    @apiErrorExample {json} 参数不合法
+        HTTP/1.1 400 Bad Request
+        {"msg": "Illegal parameter."}
+
+    @apiErrorExample {json} 用户没有加入公会
+        HTTP/1.1 403 Forbidden
+        {"msg": "User is not in any group."}
+
+    @apiErrorExample {json} 用户的公会不存在
+        HTTP/1.1 417 Expectation Failed
+        {"msg": "User's group not found."}
+
+    """
+    user: User = g.user
+    epoch_id: str = request.args.get('epoch_id', '')
+    start_date: str = request.args.get('start_date', '')
+    end_date: str = request.args.get('end_date', '')
+
+    for value in (epoch_id, start_date, end_date):
+        if value and not value.isdigit():
+            return jsonify({"msg": "Illegal parameter."}), 400
+
+    if not user.group_id or user.group_id == -1:
+        return jsonify({"msg": "User is not in any group."}), 403
+    group: Group = user.group
+    if not group:
+        return jsonify({"msg": "User's group not found."}), 417
+
+    key = (group.id, epoch_id, start_date, end_date)
+    cached = stats_cache.get(key)
+    if cached is not None and cached[0] == group.data_version:
+        stats = cached[1]
+    else:
+        stats = compute_stats(group.id,
+                              epoch_id=int(epoch_id) if epoch_id else None,
+                              start=datetime.datetime.fromtimestamp(int(start_date)) if start_date else None,
+                              end=datetime.datetime.fromtimestamp(int(end_date)) if end_date else None)
+        stats_cache.set(key, (group.data_version, stats))
+
+    return jsonify(dict(stats, msg="Successful!")), 200
@@ -0,0 +1,92 @@
+from flask import request, jsonify, g, Response
+from ..auth_tools import login_required
+from data.model import *
+from . import record_blueprint
+from .stream_tools import stream_hub, load_events
+from config import Config
+
+
+def _format_event(seq: int, name: str, data: str) -> str:
+    return 'id: ' + str(seq) + '\nevent: ' + name + '\ndata: ' + data + '\n\n'
+
+
+@record_blueprint.route('/stream', methods=['GET'])
+@login_required
+def stream():
+    """
+    @api {get} /v1/record/stream 实时接收公会的Boss状态和新的出刀记录
+    @apiVersion 1.0.0
+    @apiName stream
+    @apiGroup Records
+    @apiHeader {String} Last-Event-ID  (可选)    断线重连时上一次收到的事件 id，从这之后继续推送
+    @apiParam {int}     last_event_id  (可选)    同 Last-Event-ID，用于无法设置请求头的客户端
+    @apiDescription Server-Sent Events 推送。每个连接会一直占用一个 worker 连接，需要使用 gevent worker 运行
+    （gunicorn -k gevent wsgi）。
+    事件 team_record 为当前的 Boss 状态，personal_record 为新的出刀记录，内容分别参照 TeamRecord/PersonalRecord 表；
+    一段时间没有事件时发送注释行作为心跳。
+    事件 reset 表示错过的修改太多，客户端需要通过 /v1/record/changes 重新同步。
+
+    @apiSuccessExample {text} 成功样例
+        HTTP/1.1 200 OK
+        Content-Type: text/event-stream
+
+        id: 42
+        event: team_record
+        data: {"boss_remaining_health": 5999000, ...}
+
+    @apiErrorExample {json} 用户没有加入公会
+        HTTP/1.1 403 Forbidden
+        {"msg": "User is not in any group."}
+
+    @apiErrorExample {json} 用户的公会不存在
+        HTTP/1.1 417 Expectation Failed
+        {"msg": "User's group not found."}
+
+    """
+    user: User = g.user
+    last_event_id: str = request.headers.get('Last-Event-ID', request.args.get('last_event_id', ''))
+
+    if not user.group_id or user.group_id == -1:
+        return jsonify({"msg": "User is not in any group."}), 403
+    group: Group = user.group
+    if not group:
+        return jsonify({"msg": "User's group not found."}), 417
+
+    feed = stream_hub.subscribe(group)
+    seq = feed.seq
+    replay = list()
+    reset = False
+    if last_event_id.isdigit() and int(last_event_id) < feed.floor:
+        # 缓冲区中没有的事件从数据库补发，之后从 floor 开始接收
+        replay, _, complete = load_events(group.id, int(last_event_id), feed.floor,
+                                          getattr(Config, 'STREAM_REPLAY_LIMIT', 500))
+        reset = not complete
+        seq = feed.floor
+    elif last_event_id.isdigit():
+        seq = int(last_event_id)
+    heartbeat = getattr(Config, 'STREAM_HEARTBEAT', 15)
+
+    # 生成器在请求结束后运行，不能再使用数据库和 request
+    def generate(seq: int):
+        yield 'retry: 3000\n\n'
+        if reset:
+            yield _format_event(seq, 'reset', '{}')
+        else:
+            for item in replay:
+                yield _format_event(*item)
+        while True:
+            events, current = feed.wait(seq, heartbeat)
+            if events is None:
+                yield _format_event(current, 'reset', '{}')
+            elif events:
+                for item in events:
+                    yield _format_event(*item)
+            elif current == seq:
+                yield ': heartbeat\n\n'
+            seq = current
+
+    response = Response(generate(seq), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # 客户端断开后服务器关闭响应时调用，即使生成器还没有开始运行
+    response.call_on_close(lambda: stream_hub.unsubscribe(feed))
+    return response
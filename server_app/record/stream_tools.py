@@ -0,0 +1,164 @@
+from flask import current_app
+from data.model import db, ChangeLog, PersonalRecord, TeamRecord, Group
+from data.alchemy_encoder import AlchemyEncoder
+from sqlalchemy import event
+from collections import deque
+from typing import List, Optional, Tuple
+import json as js
+import logging
+import threading
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def load_events(group_id: int, after_seq: int, until_seq: Optional[int], limit: int) -> Tuple[List[tuple], int, bool]:
+    """
+    把 change_log 中 after_seq 之后的修改转换为推送事件：Boss 状态变化和新的出刀记录。
+    :return: ([(seq, 事件名, JSON)], 读到的最大 seq, 是否已经读完)
+    """
+    query = ChangeLog.query.filter(ChangeLog.group_id == group_id, ChangeLog.seq > after_seq)
+    if until_seq is not None:
+        query = query.filter(ChangeLog.seq <= until_seq)
+    entries = query.order_by(ChangeLog.seq, ChangeLog.id).limit(limit + 1).all()
+    complete = len(entries) <= limit
+    if not complete:
+        # 不拆开同一个事务的修改
+        last_seq = entries[limit].seq
+        entries = [entry for entry in entries if entry.seq < last_seq] or \
+            ChangeLog.query.filter(ChangeLog.group_id == group_id, ChangeLog.seq == last_seq) \
+            .order_by(ChangeLog.id).all()
+    if not entries:
+        return [], after_seq, complete
+
+    record_ids = [entry.row_id for entry in entries
+                  if entry.table_name == 'personal_record' and entry.operation == 'insert']
+    records = dict()
+    if record_ids:
+        for record in PersonalRecord.query.filter(PersonalRecord.id.in_(record_ids)):
+            records[record.id] = record
+    # 只推送每个 TeamRecord 最后的状态
+    team_record_seq = dict()
+    for entry in entries:
+        if entry.table_name == 'team_record' and entry.operation != 'delete':
+            team_record_seq[entry.row_id] = entry.seq
+
+    events = list()
+    for entry in entries:
+        if entry.table_name == 'personal_record' and entry.row_id in records:
+            events.append((entry.seq, 'personal_record', js.dumps(records.pop(entry.row_id), cls=AlchemyEncoder)))
+    for row_id, seq in team_record_seq.items():
+        team_record = TeamRecord.query.get(row_id)
+        if team_record is not None:
+            events.append((seq, 'team_record', js.dumps(team_record, cls=AlchemyEncoder)))
+    events.sort(key=lambda item: item[0])
+    return events, entries[-1].seq, complete
+
+
+class GroupFeed:
+    """
+    一个公会在当前 worker 中的事件缓冲区，所有订阅者共享。
+    订阅者在 Condition 上等待，没有新事件时不占用 CPU。
+    """
+
+    def __init__(self, group_id: int, seq: int, buffer_size: int):
+        self.group_id = group_id
+        # 已经读到的 change_log 序号
+        self.seq = seq
+        # floor 之后的事件都在缓冲区中
+        self.floor = seq
+        self.subscribers = 0
+        self.wake = threading.Event()
+        self._events = deque()
+        self._buffer_size = buffer_size
+        self._condition = threading.Condition()
+
+    def publish(self, events: List[tuple], seq: int):
+        with self._condition:
+            self._events.extend(events)
+            while len(self._events) > self._buffer_size:
+                self.floor = self._events.popleft()[0]
+            self.seq = seq
+            self._condition.notify_all()
+
+    def wait(self, after_seq: int, timeout: float) -> Tuple[Optional[List[tuple]], int]:
+        """
+        :return: (after_seq 之后的事件, 当前 seq)，超时时事件为空；after_seq 早于缓冲区时事件为 None
+        """
+        with self._condition:
+            if self.seq <= after_seq:
+                self._condition.wait(timeout)
+            if after_seq < self.floor:
+                return None, self.seq
+            return [item for item in self._events if item[0] > after_seq], self.seq
+
+
+class StreamHub:
+    """
+    每个 worker 中每个有订阅者的公会只有一个后台线程读取 change_log，事件分发给该公会的所有订阅者。
+    本进程提交修改后立即唤醒对应的线程，其他进程的修改在 poll_interval 内读到。
+    """
+
+    def __init__(self, poll_interval: float, buffer_size: int, batch_size: int):
+        self.poll_interval = poll_interval
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self._feeds = dict()
+        self._lock = threading.Lock()
+
+    def subscribe(self, group: Group) -> GroupFeed:
+        app = current_app._get_current_object()
+        with self._lock:
+            feed = self._feeds.get(group.id)
+            if feed is None:
+                feed = GroupFeed(group.id, group.data_version, self.buffer_size)
+                self._feeds[group.id] = feed
+                threading.Thread(target=self._poll, args=(app, feed), daemon=True).start()
+            feed.subscribers += 1
+        return feed
+
+    def unsubscribe(self, feed: GroupFeed):
+        with self._lock:
+            feed.subscribers -= 1
+        feed.wake.set()
+
+    def wake(self, group_id: int):
+        feed = self._feeds.get(group_id)
+        if feed is not None:
+            feed.wake.set()
+
+    def _poll(self, app, feed: GroupFeed):
+        with app.app_context():
+            while True:
+                feed.wake.wait(self.poll_interval)
+                feed.wake.clear()
+                with self._lock:
+                    if feed.subscribers <= 0:
+                        del self._feeds[feed.group_id]
+                        return
+                try:
+                    complete = False
+                    while not complete:
+                        events, seq, complete = load_events(feed.group_id, feed.seq, None, self.batch_size)
+                        if seq > feed.seq:
+                            feed.publish(events, seq)
+                except Exception as e:
+                    logger.error('Failed to poll change log of group %s: %s', feed.group_id, e)
+                finally:
+                    db.session.remove()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"groups": len(self._feeds),
+                    "subscribers": sum(feed.subscribers for feed in self._feeds.values())}
+
+
+stream_hub = StreamHub(poll_interval=getattr(Config, 'STREAM_POLL_INTERVAL', 1),
+                       buffer_size=getattr(Config, 'STREAM_BUFFER_SIZE', 256),
+                       batch_size=getattr(Config, 'STREAM_BATCH_SIZE', 500))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_streams(session):
+    for group_id in session.info.pop('changed_groups', ()):
+        stream_hub.wake(group_id)
@@ -0,0 +1,107 @@
+from data.model import db, PersonalRecord, MemberDailySummary
+from data.get_date_int import get_battle_day
+from server_app.group_tools import bump_data_version
+from sqlalchemy import func, case, and_, bindparam
+from typing import Optional, List
+
+SUMMARY_KEYS = ('group_id', 'epoch_id', 'day', 'user_id')
+SUMMARY_COLUMNS = ('damage', 'score', 'attacks', 'last_hits', 'compensation_hits')
+
+
+def _summary_key(record: PersonalRecord) -> tuple:
+    return (record.group_id,
+            record.epoch_id,
+            record.battle_day if record.battle_day is not None else get_battle_day(record.detail_date),
+            record.user_id)
+
+
+def _summary_delta(record: PersonalRecord, sign: int) -> dict:
+    return dict(damage=sign * int(record.damage or 0),
+                score=sign * int(record.score or 0),
+                attacks=sign,
+                last_hits=sign if record.type == 'last' else 0,
+                compensation_hits=sign if record.type == 'compensation' else 0)
+
+
+def add_to_summary(record: PersonalRecord, sign: int = 1):
+    """
+    把一条出刀加入（sign=1）或移出（sign=-1）成员当天的合计，在修改出刀记录的同一个事务中调用。
+    先锁住公会一行，同一个公会的合计不会被并发修改。
+    """
+    if record.user_id is None or record.epoch_id is None:
+        return
+    bump_data_version(record.group_id)
+    key = dict(zip(SUMMARY_KEYS, _summary_key(record)))
+    delta = _summary_delta(record, sign)
+    query = MemberDailySummary.query.filter_by(**key)
+    updated = query.update({getattr(MemberDailySummary, column): getattr(MemberDailySummary, column) + value
+                            for column, value in delta.items()}, synchronize_session=False)
+    if not updated:
+        if sign > 0:
+            db.session.add(MemberDailySummary(**key, **delta))
+    elif sign < 0:
+        query.filter(MemberDailySummary.attacks <= 0).delete(synchronize_session=False)
+
+
+def add_records_to_summary(records: List[PersonalRecord]):
+    """
+    批量出刀时使用：先在内存中按 (公会, 会战, 会战日, 成员) 合并，
+    已有的合计用一条 executemany 的 UPDATE 累加，没有的合计一次插入，语句数与记录数无关。
+    """
+    deltas = dict()
+    for record in records:
+        if record.user_id is None or record.epoch_id is None:
+            continue
+        total = deltas.setdefault(_summary_key(record), dict.fromkeys(SUMMARY_COLUMNS, 0))
+        for column, value in _summary_delta(record, 1).items():
+            total[column] += value
+    if not deltas:
+        return
+    for group_id in {key[0] for key in deltas}:
+        bump_data_version(group_id)
+
+    # 公会已经锁住，查到的合计在事务提交前不会被其他请求插入或删除
+    columns = [getattr(MemberDailySummary, key) for key in SUMMARY_KEYS]
+    existing = db.session.query(*columns) \
+        .filter(*[column.in_({key[i] for key in deltas}) for i, column in enumerate(columns)])
+    existing = {tuple(row) for row in existing} & set(deltas)
+
+    table = MemberDailySummary.__table__
+    if existing:
+        update = table.update() \
+            .where(and_(*[table.c[key] == bindparam('key_' + key) for key in SUMMARY_KEYS])) \
+            .values({column: table.c[column] + bindparam('delta_' + column) for column in SUMMARY_COLUMNS})
+        db.session.execute(update, [
+            dict({'key_' + name: value for name, value in zip(SUMMARY_KEYS, key)},
+                 **{'delta_' + column: value for column, value in deltas[key].items()})
+            for key in existing])
+    db.session.bulk_insert_mappings(MemberDailySummary, [dict(zip(SUMMARY_KEYS, key), **delta)
+                                                         for key, delta in deltas.items() if key not in existing])
+
+
+def rebuild_daily_summary(group_id: Optional[int] = None, user_ids: Optional[List[int]] = None) -> int:
+    """
+    根据出刀记录重新计算合计，用于初次填充和修复。
+    :return: 写入的行数
+    """
+    summary = MemberDailySummary.query
+    records = db.session.query(PersonalRecord.group_id, PersonalRecord.epoch_id,
+                               PersonalRecord.battle_day, PersonalRecord.user_id,
+                               func.sum(PersonalRecord.damage), func.sum(PersonalRecord.score),
+                               func.count(PersonalRecord.id),
+                               func.sum(case([(PersonalRecord.type == 'last', 1)], else_=0)),
+                               func.sum(case([(PersonalRecord.type == 'compensation', 1)], else_=0))) \
+        .filter(PersonalRecord.user_id.isnot(None))
+    if group_id is not None:
+        bump_data_version(group_id)
+        summary = summary.filter(MemberDailySummary.group_id == group_id)
+        records = records.filter(PersonalRecord.group_id == group_id)
+    if user_ids is not None:
+        summary = summary.filter(MemberDailySummary.user_id.in_(user_ids))
+        records = records.filter(PersonalRecord.user_id.in_(user_ids))
+    summary.delete(synchronize_session=False)
+    rows = records.group_by(PersonalRecord.group_id, PersonalRecord.epoch_id, PersonalRecord.battle_day,
+                            PersonalRecord.user_id).all()
+    keys = SUMMARY_KEYS + SUMMARY_COLUMNS
+    db.session.bulk_insert_mappings(MemberDailySummary, [dict(zip(keys, row)) for row in rows])
+    return len(rows)
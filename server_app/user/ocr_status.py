@@ -4,7 +4,7 @@ from ..auth_tools import login_required
 from data.model import *
 from data.alchemy_encoder import AlchemyEncoder
 from . import user_blueprint
-from server_app.qq_tools import send_message_to_qq
+from server_app.qq_tools import send_message_to_qq_later
 
 
 @user_blueprint.route('/get_ocr_status', methods=['GET'])
@@ -61,6 +61,6 @@ def set_ocr_status():
             return jsonify({'msg': status_text})
         elif not is_fetching:
             headers = dict(auth=request.headers.get('auth'))
-            send_message_to_qq(status_text, id_=user.qq, type_='private', header=headers)
+            send_message_to_qq_later(status_text, id_=user.qq, type_='private', header=headers)
     else:
         return jsonify({'msg': 'Invalid argument'}), 412
@@ -0,0 +1,114 @@
+import datetime
+import os
+import sys
+import tempfile
+import time
+import types
+import jwt
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 测试使用临时的 SQLite 数据库；config.py 不在仓库中，这里提供测试用的配置
+_temp_dir = tempfile.mkdtemp()
+
+
+class TestConfig:
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(_temp_dir, 'test.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    TESTING = True
+    SECRET_KEY = 'test-secret'
+    DOMAIN_NAME = 'api.test'
+    FRONTEND_DOMAIN_NAME = 'web.test'
+    SELF_URL = 'http://localhost'
+    BOSS_HEALTH = [100000, 100000, 100000, 100000, 100000]
+    QQ_BOT_URL = 'http://qq.test'
+    TPN_ACCESS_ID = 1
+    TPN_SECRET_KEY = 'test'
+    REPORT_CACHE_DIR = os.path.join(_temp_dir, 'reports')
+
+
+config = types.ModuleType('config')
+config.Config = TestConfig
+sys.modules['config'] = config
+
+from server_app import create_app  # noqa: E402
+from data.model import db, Group, User, TeamBattleEpoch  # noqa: E402
+
+
+class FakeResponse:
+    status_code = 200
+    content = b'{}'
+    text = '{}'
+
+    def json(self):
+        return {}
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(TeamBattleEpoch(name='test',
+                                       from_date=datetime.datetime.now() - datetime.timedelta(days=1),
+                                       end_date=datetime.datetime.now() + datetime.timedelta(days=5)))
+        db.session.commit()
+    return app
+
+
+# 所有对外的 HTTP 请求只记录，不真正发送；后台线程在测试结束后发出的请求也不会访问网络
+_requests_sent = list()
+
+
+def _fake_post(session, url, **kwargs):
+    _requests_sent.append((url, kwargs))
+    return FakeResponse()
+
+
+requests.Session.post = _fake_post
+
+
+@pytest.fixture(autouse=True)
+def sent():
+    """
+    这个测试中发出的 HTTP 请求
+    """
+    _requests_sent.clear()
+    return _requests_sent
+
+
+@pytest.fixture
+def group(app):
+    """
+    每个测试使用新的公会，内存中按公会缓存的数据不会互相影响
+    """
+    with app.app_context():
+        group = Group(name='test', description='', must_request=False, leader_id='0', is_temp=False,
+                      group_chat_id='10000')
+        db.session.add(group)
+        db.session.commit()
+        now = datetime.datetime.now()
+        owner = User(username='owner-%d' % group.id, nickname='owner', role=2, password='x', created_at=now,
+                     email_verified=True, phone_verified=False,
+                     valid_since=now - datetime.timedelta(days=1), group_id=group.id)
+        db.session.add(owner)
+        db.session.commit()
+        group.leader_id = str(owner.id)
+        db.session.commit()
+        return dict(id=group.id, owner_id=owner.id)
+
+
+def auth_header(user_id: int) -> dict:
+    token = jwt.encode({'sub': user_id, 'iat': int(time.time()), 'aud': TestConfig.DOMAIN_NAME},
+                       TestConfig.SECRET_KEY, algorithm='HS256')
+    return {'auth': token if isinstance(token, str) else token.decode()}
+
+
+@pytest.fixture
+def headers(group):
+    return auth_header(group['owner_id'])
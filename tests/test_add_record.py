@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from data.model import db, Group, PersonalRecord, TeamRecord
+from server_app.record.record_tools import next_boss_state, read_team_record
+
+
+def post_attacks(app, headers, bodies, threads=16):
+    def post(body):
+        with app.test_client() as client:
+            return client.post('/v1/record/add_record', headers=headers, json=body).status_code
+
+    with ThreadPoolExecutor(threads) as executor:
+        return list(executor.map(post, bodies))
+
+
+def replay(group_id):
+    """
+    按提交顺序重放出刀，返回 (最终状态, 记在非当前 boss 上的出刀数)
+    """
+    state = (1, 1, 100000)
+    misplaced = 0
+    for record in PersonalRecord.query.filter(PersonalRecord.group_id == group_id).order_by(PersonalRecord.id):
+        if (record.boss_gen, record.boss_order) != state[:2]:
+            misplaced += 1
+        state = next_boss_state(*state, record.damage)
+    return state, misplaced
+
+
+def boss_state(group_id):
+    team_record = TeamRecord.query.filter(TeamRecord.group_id == group_id).one()
+    return team_record.current_boss_gen, team_record.current_boss_order, team_record.boss_remaining_health
+
+
+def test_concurrent_attacks_keep_every_damage(app, group, headers):
+    # 没有 TeamRecord 时同时到达的第一刀也在其中
+    codes = post_attacks(app, headers, [{'damage': 7000, 'type': 'normal'}] * 120)
+    assert codes == [200] * 120
+    with app.app_context():
+        assert TeamRecord.query.filter(TeamRecord.group_id == group['id']).count() == 1
+        state, misplaced = replay(group['id'])
+        assert misplaced == 0
+        assert boss_state(group['id']) == state
+        # 每个 boss 15 刀击破，共 8 个 boss
+        assert state == (2, 4, 100000)
+
+
+def test_defaulted_boss_follows_database_not_cache(app, group, headers):
+    with app.test_client() as client:
+        assert client.post('/v1/record/add_record', headers=headers,
+                           json={'damage': 1000, 'type': 'normal'}).status_code == 200
+    with app.app_context():
+        # 另一个 worker 击破了 1 王，这个进程的缓存仍是旧状态
+        TeamRecord.query.filter(TeamRecord.group_id == group['id']) \
+            .update({TeamRecord.current_boss_order: 2}, synchronize_session=False)
+        db.session.commit()
+    with app.test_client() as client:
+        assert client.post('/v1/record/add_record', headers=headers,
+                           json={'damage': 2000, 'type': 'normal'}).status_code == 200
+    with app.app_context():
+        record = PersonalRecord.query.filter(PersonalRecord.group_id == group['id']) \
+            .order_by(PersonalRecord.id.desc()).first()
+        assert (record.boss_gen, record.boss_order) == (1, 2)
+        assert boss_state(group['id']) == (1, 2, 97000)
+
+
+def test_attack_on_killed_boss_does_not_change_state(app, group, headers):
+    post_attacks(app, headers, [{'damage': 100000, 'type': 'last'}])
+    codes = post_attacks(app, headers, [{'damage': 5000, 'type': 'normal', 'boss_gen': 1, 'boss_order': 1}])
+    assert codes == [200]
+    with app.app_context():
+        assert boss_state(group['id']) == (1, 2, 100000)
+
+
+def test_cached_boss_state_follows_data_version(app, group, headers):
+    with app.test_client() as client:
+        assert client.post('/v1/record/add_record', headers=headers,
+                           json={'damage': 1000, 'type': 'normal'}).status_code == 200
+    with app.app_context():
+        # 另一个 worker 修改了 Boss 状态，这个进程的缓存仍在有效期内
+        TeamRecord.query.filter(TeamRecord.group_id == group['id']) \
+            .update({TeamRecord.boss_remaining_health: 50000}, synchronize_session=False)
+        Group.query.filter(Group.id == group['id']) \
+            .update({Group.data_version: Group.data_version + 1}, synchronize_session=False)
+        db.session.commit()
+        data_version = Group.query.get(group['id']).data_version
+        assert read_team_record(group['id'], data_version).boss_remaining_health == 50000
+        # 同一版本的读取使用缓存
+        TeamRecord.query.filter(TeamRecord.group_id == group['id']) \
+            .update({TeamRecord.boss_remaining_health: 40000}, synchronize_session=False)
+        db.session.commit()
+        assert read_team_record(group['id'], data_version).boss_remaining_health == 50000
@@ -0,0 +1,73 @@
+from contextlib import contextmanager
+from sqlalchemy import event, func
+from data.model import db, ChangeLog, MemberDailySummary
+from server_app.record.summary_tools import rebuild_daily_summary
+
+
+@contextmanager
+def count_statements(app):
+    """
+    记录执行的 SQL 语句，executemany 只算一条
+    """
+    statements = list()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def post_bulk(app, headers, count):
+    records = [{'damage': 100, 'type': 'normal'} for _ in range(count)]
+    with app.test_client() as client:
+        return client.post('/v1/record/add_records_bulk', headers=headers, json={'records': records})
+
+
+def test_bulk_writes_change_log_in_one_statement(app, group, headers):
+    # 先创建公会的 TeamRecord
+    assert post_bulk(app, headers, 1).status_code == 200
+    with count_statements(app) as statements:
+        assert post_bulk(app, headers, 100).status_code == 200
+    inserts = [statement for statement in statements if statement.startswith('INSERT INTO change_log')]
+    assert len(inserts) == 1
+    with app.app_context():
+        seq = db.session.query(func.max(ChangeLog.seq)).filter(ChangeLog.group_id == group['id']).scalar()
+        # 100 条出刀记录和一条 Boss 状态
+        assert ChangeLog.query.filter(ChangeLog.group_id == group['id'], ChangeLog.seq == seq).count() == 101
+
+
+def test_bulk_updates_each_daily_summary_once(app, group, headers):
+    assert post_bulk(app, headers, 1).status_code == 200
+    with count_statements(app) as statements:
+        assert post_bulk(app, headers, 100).status_code == 200
+    summary_writes = [statement for statement in statements
+                      if statement.startswith(('UPDATE member_daily_summary', 'INSERT INTO member_daily_summary'))]
+    assert len(summary_writes) == 1
+    with app.app_context():
+        summary = MemberDailySummary.query.filter(MemberDailySummary.group_id == group['id']).one()
+        assert (summary.attacks, summary.damage) == (101, 10100)
+        # 与根据出刀记录重建的结果相同
+        rebuilt = rebuild_daily_summary(group['id'])
+        assert rebuilt == 1
+        summary = MemberDailySummary.query.filter(MemberDailySummary.group_id == group['id']).one()
+        assert (summary.attacks, summary.damage) == (101, 10100)
+        db.session.rollback()
+
+
+def test_malformed_item_is_rejected_before_writing(app, group, headers):
+    for malformed in [{'user_id': 'abc'}, {'detail_date': '2020-01-01'}, {'damage': '1e5'},
+                      {'boss_gen': [1]}, {'boss_order': 6}, {'detail_date': 10 ** 20}]:
+        records = [{'damage': 100, 'type': 'normal'} for _ in range(99)]
+        records.append(dict({'damage': 100, 'type': 'normal'}, **malformed))
+        with app.test_client() as client:
+            response = client.post('/v1/record/add_records_bulk', headers=headers, json={'records': records})
+        assert response.status_code == 400
+        assert response.get_json()['code'] == 301
+    with app.app_context():
+        assert ChangeLog.query.filter(ChangeLog.group_id == group['id']).count() == 0
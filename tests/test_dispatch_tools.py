@@ -0,0 +1,58 @@
+import datetime
+import json
+import threading
+from data.model import db, Outbox
+from server_app.dispatch_tools import Dispatcher
+
+
+def make_dispatcher(persistent=False):
+    return Dispatcher(max_size=100, max_attempts=3, backoff=0.01, persistent=persistent, lease=0.1)
+
+
+def test_slow_destination_does_not_block_others(app):
+    dispatcher = make_dispatcher()
+    dispatcher.init_app(app)
+    release = threading.Event()
+    fast_sent = threading.Event()
+    dispatcher.register('slow', lambda: release.wait(5), concurrency=2)
+    dispatcher.register('fast', lambda: fast_sent.set(), concurrency=1)
+    for _ in range(10):
+        dispatcher.enqueue('slow')
+    dispatcher.enqueue('fast')
+    try:
+        assert fast_sent.wait(1)
+        assert dispatcher.metrics()['destinations']['slow']['queue_depth'] >= 8
+    finally:
+        release.set()
+
+
+def test_outbox_is_swept_at_app_init(app):
+    with app.app_context():
+        db.session.add(Outbox(destination='swept', payload=json.dumps(dict(value=1)), owner='crashed:1',
+                              created_at=datetime.datetime.now(),
+                              claimed_until=datetime.datetime.now() - datetime.timedelta(seconds=1)))
+        db.session.commit()
+    sent = threading.Event()
+    dispatcher = make_dispatcher(persistent=True)
+    dispatcher.register('swept', lambda value: sent.set(), concurrency=1)
+    # 没有新的入队，只靠启动时的清扫发送
+    dispatcher.init_app(app)
+    assert sent.wait(2)
+
+
+def test_outbox_failure_does_not_fail_committed_request(app, group, headers, monkeypatch):
+    from data.model import PersonalRecord
+    from server_app.dispatch_tools import dispatcher
+    monkeypatch.setattr(dispatcher, 'persistent', True)
+    with app.app_context():
+        # 只执行了 flask db upgrade、还没有 outbox 表的数据库
+        Outbox.__table__.drop(db.engine)
+    try:
+        with app.test_client() as client:
+            assert client.post('/v1/record/add_record', headers=headers,
+                               json={'damage': 1000, 'type': 'normal'}).status_code == 200
+        with app.app_context():
+            assert PersonalRecord.query.filter(PersonalRecord.group_id == group['id']).count() == 1
+    finally:
+        with app.app_context():
+            Outbox.__table__.create(db.engine)
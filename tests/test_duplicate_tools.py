@@ -0,0 +1,35 @@
+from data.model import db, Group
+from server_app.record import duplicate_tools
+
+
+def test_recent_damage_reloads_only_when_data_version_changes(app, group, headers, monkeypatch):
+    loads = list()
+    load = duplicate_tools._load_recent_damage
+
+    def counting_load(*args):
+        loads.append(args)
+        return load(*args)
+
+    monkeypatch.setattr(duplicate_tools, '_load_recent_damage', counting_load)
+
+    def post(damage):
+        with app.test_client() as client:
+            response = client.post('/v1/record/add_record_if_needed', headers=headers,
+                                   json={'damage': damage, 'nickname': 'owner'})
+        assert response.status_code == 200
+        return response.get_json()['msg']
+
+    # 每一行新的 OCR 结果都不在索引中，但只在第一次加载
+    for damage in (1000, 2000, 3000):
+        assert post(damage) == 'Successful!'
+    assert len(loads) == 1
+    assert post(2000) == 'Already Recorded. '
+    assert len(loads) == 1
+
+    with app.app_context():
+        # 其他 worker 添加了记录
+        Group.query.filter(Group.id == group['id']) \
+            .update({Group.data_version: Group.data_version + 1}, synchronize_session=False)
+        db.session.commit()
+    assert post(4000) == 'Successful!'
+    assert len(loads) == 2
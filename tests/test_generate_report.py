@@ -0,0 +1,33 @@
+import datetime
+from sqlalchemy import func
+from data.model import db, PersonalRecord
+from server_app.generate_report import generate_report_tool
+from server_app.generate_report.generate_report_tool import compute_pivots
+
+
+def test_pivots_accumulate_across_chunks(app, group, monkeypatch):
+    # 每批 20 行，记录分成多批读取
+    monkeypatch.setattr(generate_report_tool, 'REPORT_BATCH_SIZE', 2)
+    start = datetime.datetime(2020, 1, 1, 12)
+    with app.app_context():
+        db.session.bulk_insert_mappings(PersonalRecord, [
+            dict(group_id=group['id'], user_id=i % 7 + 1, nickname='member', boss_gen=1, boss_order=i % 5 + 1,
+                 damage=1000 + i, score=2000 + i, type=('normal', 'last', 'compensation')[i % 3], epoch_id=1,
+                 detail_date=start + datetime.timedelta(hours=i), battle_day=20200101 + i // 24,
+                 last_modified=start)
+            for i in range(100)])
+        db.session.commit()
+
+        pivots = compute_pivots(group['id'])
+        expected = db.session.query(PersonalRecord.user_id, func.sum(PersonalRecord.damage),
+                                    func.sum(PersonalRecord.score), func.count(PersonalRecord.id)) \
+            .filter(PersonalRecord.group_id == group['id']) \
+            .group_by(PersonalRecord.user_id).order_by(PersonalRecord.user_id).all()
+        assert pivots.members.tolist() == [user_id for user_id, _, _, _ in expected]
+        assert pivots.days.tolist() == [20200101, 20200102, 20200103, 20200104, 20200105]
+        assert pivots.day_damage.sum(axis=1).tolist() == [damage for _, damage, _, _ in expected]
+        assert pivots.day_score.sum(axis=1).tolist() == [score for _, _, score, _ in expected]
+        assert pivots.attacks.tolist() == [attacks for _, _, _, attacks in expected]
+        assert pivots.boss_attacks.sum() == 100
+        assert pivots.last_hits.sum() == 33
+        assert pivots.compensation_hits.sum() == 33
@@ -0,0 +1,72 @@
+import datetime
+import json
+from sqlalchemy import event
+from data.model import db, Group, PersonalRecord, TeamRecord
+from config import Config
+
+
+def test_stream_survives_other_queries_on_the_connection(app, group, headers, monkeypatch):
+    monkeypatch.setattr(Config, 'STREAM_RECORDS_BATCH_SIZE', 5, raising=False)
+    start = datetime.datetime.now() - datetime.timedelta(hours=1)
+    with app.app_context():
+        db.session.bulk_insert_mappings(PersonalRecord, [
+            dict(group_id=group['id'], user_id=group['owner_id'], nickname='owner', boss_gen=1, boss_order=1,
+                 damage=1000 + i, score=1000 + i, type='normal', epoch_id=1,
+                 detail_date=start + datetime.timedelta(seconds=i), last_modified=start)
+            for i in range(30)])
+        db.session.commit()
+        engine = db.engine
+
+    # 模拟 pymysql：同一连接上执行下一条语句时，未读完的结果被读出并丢弃
+    streaming = dict()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT') and 'FROM personal_record' in statement:
+            streaming[id(conn.connection.connection)] = cursor
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        previous = streaming.pop(id(conn.connection.connection), None)
+        if previous is not None and previous is not cursor:
+            try:
+                previous.fetchall()
+            except Exception:
+                pass
+
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        with app.test_client() as client:
+            response = client.get('/v1/record/get_records', headers=headers, query_string={'type': 'personal'},
+                                  buffered=False)
+            assert response.status_code == 200
+            # 输出还没有结束时，请求的 Session 上执行其他查询
+            assert db.session.query(PersonalRecord).filter(PersonalRecord.group_id == group['id']).count() == 30
+            data = json.loads(response.get_data())
+    finally:
+        event.remove(engine, 'after_cursor_execute', after_cursor_execute)
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    assert len(data['data']) == 30
+    assert [row['damage'] for row in data['data']] == list(range(1029, 999, -1))
+
+
+def test_etag_matches_team_record_body(app, group, headers):
+    with app.test_client() as client:
+        assert client.post('/v1/record/add_record', headers=headers,
+                           json={'damage': 1000, 'type': 'normal'}).status_code == 200
+        response = client.get('/v1/record/get_current_team_record', headers=headers)
+        assert json.loads(response.get_data())['data']['boss_remaining_health'] == 99000
+    with app.app_context():
+        # 另一个 worker 写入了新的 Boss 状态，这个进程的缓存仍在有效期内
+        TeamRecord.query.filter(TeamRecord.group_id == group['id']) \
+            .update({TeamRecord.boss_remaining_health: 50000}, synchronize_session=False)
+        Group.query.filter(Group.id == group['id']) \
+            .update({Group.data_version: Group.data_version + 1}, synchronize_session=False)
+        db.session.commit()
+    with app.test_client() as client:
+        for path, query_string in [('/v1/record/get_current_team_record', {}),
+                                   ('/v1/record/get_records', {'type': 'team'})]:
+            response = client.get(path, headers=headers, query_string=query_string)
+            assert json.loads(response.get_data())['data']['boss_remaining_health'] == 50000
+            etag = response.headers['ETag']
+            assert client.get(path, headers=dict(headers, **{'If-None-Match': etag}),
+                              query_string=query_string).status_code == 304
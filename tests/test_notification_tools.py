@@ -0,0 +1,43 @@
+import time
+from data.model import Outbox
+from server_app.dispatch_tools import dispatcher
+from server_app.notification_tools import notification_coalescer
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_coalesced_notifications_are_persisted_and_sent(app, group, headers, sent, monkeypatch):
+    monkeypatch.setattr(dispatcher, 'persistent', True)
+    monkeypatch.setattr(notification_coalescer, 'window', 0.5)
+    with app.test_client() as client:
+        assert client.post('/v1/record/add_records_bulk', headers=headers, json={'records': [
+            {'damage': 1000, 'type': 'normal'},
+            {'damage': 2000, 'type': 'normal'},
+        ]}).status_code == 200
+        assert client.post('/v1/record/add_record', headers=headers,
+                           json={'damage': 3000, 'type': 'normal'}).status_code == 200
+    with app.app_context():
+        # 等待合并期间通知已经写入 outbox，进程退出也不会丢失
+        assert Outbox.query.filter(Outbox.destination == 'notification').count() == 2
+
+    def pushes():
+        # 其他测试的通知可能在这个测试中才发出，只看这个公会的推送
+        tag = 'group-' + str(group['id'])
+        return [kwargs['json']['message']['content'] for url, kwargs in sent
+                if 'tpns' in url and kwargs['json']['tag_rules'][0]['tag_items'][0]['tags'] == [tag]]
+
+    def qq_messages():
+        return [kwargs['json']['message'] for url, kwargs in sent if 'qq.test' in url]
+
+    # 批量出刀的两条记录也计入条数
+    assert wait_for(lambda: any(content.startswith('3条新纪录。') for content in pushes()))
+    assert wait_for(lambda: any(message.startswith('添加了3条新的记录喵！') for message in qq_messages()))
+    with app.app_context():
+        assert wait_for(lambda: Outbox.query.count() == 0)
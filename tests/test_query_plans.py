@@ -0,0 +1,8 @@
+from server_app.record.query_plan_tools import check_query_plans
+
+
+def test_hot_queries_use_their_indexes(app, group):
+    with app.app_context():
+        results = check_query_plans(group['id'])
+    assert results
+    assert [name for name, uses_index, plan in results if not uses_index] == []
@@ -0,0 +1,19 @@
+import time
+from server_app.record.stats import stats_cache
+
+
+def test_stats_cache_is_bounded_across_date_ranges(app, group, headers, monkeypatch):
+    monkeypatch.setattr(stats_cache, 'max_size', 10)
+    now = int(time.time())
+    with app.test_client() as client:
+        assert client.post('/v1/record/add_record', headers=headers,
+                           json={'damage': 1000, 'type': 'normal'}).status_code == 200
+        for offset in range(30):
+            response = client.get('/v1/record/stats', headers=headers,
+                                  query_string={'start_date': now - 3600 - offset, 'end_date': now + 3600})
+            assert response.status_code == 200
+            assert response.get_json()['members'][0]['damage'] == 1000
+    # 每一项都是一次统计的结果，缓存的结果总数不超过上限
+    held = [stats for _, (version, stats) in stats_cache._data.values()]
+    assert len(held) <= 10
+    assert all('members' in stats for stats in held)